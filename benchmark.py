@@ -0,0 +1,327 @@
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+
+from password_generator import RATE_LIMIT_MAX, RATE_LIMIT_WINDOW
+from rate_limiter import SlidingWindowLimiter
+from secure_storage import LISTING_CACHE_SIZE, SecureStorage, calibrate_kdf
+
+
+def bench_storage(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        # The listing cache would turn most reads into dictionary lookups;
+        # it is off unless asked for, so the numbers reflect SQLite and crypto.
+        storage = SecureStorage(os.path.join(tmp, "bench.db"), pool_size=max(args.users),
+                                listing_cache_size=LISTING_CACHE_SIZE if args.listing_cache else 0)
+        for user_id in range(max(args.users)):
+            for i in range(args.accounts):
+                storage.save_password(user_id, f"account{i}", f"password{i}")
+
+        print(f"{'users':>6} {'ops':>8} {'ops/s':>10}")
+        for users in args.users:
+            stop = threading.Event()
+            counts = [0] * users
+
+            def worker(idx):
+                rnd = random.Random(idx)
+                n = 0
+                while not stop.is_set():
+                    if rnd.random() < args.write_ratio:
+                        storage.save_password(idx, f"extra{n}", "password")
+                    else:
+                        storage.get_passwords(idx)
+                    n += 1
+                counts[idx] = n
+
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(users)]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            time.sleep(args.duration)
+            stop.set()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start
+            total = sum(counts)
+            print(f"{users:>6} {total:>8} {total / elapsed:>10.0f}")
+        storage.close()
+
+
+class LegacyLimiter:
+    # The original list-of-timestamps implementation, kept for comparison.
+    def __init__(self, max_requests, window):
+        self.max_requests = max_requests
+        self.window = window
+        self._user_requests = {}
+
+    def __len__(self):
+        return len(self._user_requests)
+
+    def hit(self, user_id, now):
+        ts_list = self._user_requests.get(user_id, [])
+        ts_list = [t for t in ts_list if now - t < self.window]
+        if len(ts_list) >= self.max_requests:
+            self._user_requests[user_id] = ts_list
+            return False
+        ts_list.append(now)
+        self._user_requests[user_id] = ts_list
+        return True
+
+
+def bench_ratelimit(args):
+    cls = LegacyLimiter if args.legacy else SlidingWindowLimiter
+    limiter = cls(RATE_LIMIT_MAX, RATE_LIMIT_WINDOW)
+    # Simulated clock: args.rate checks per second spread over args.active
+    # recently seen users, with a brand new user id every args.new_every checks.
+    step = 1.0 / args.rate
+    segment = args.checks // args.segments
+    next_user = args.active
+    now = 0.0
+    rnd = random.Random(0)
+
+    print(f"{'checks':>10} {'entries':>9} {'ns/check':>9} {'maxrss MB':>10}")
+    done = 0
+    for _ in range(args.segments):
+        users = []
+        for i in range(segment):
+            if i % args.new_every == 0:
+                next_user += 1
+                users.append(next_user)
+            else:
+                users.append(next_user - rnd.randrange(args.active))
+        hit = limiter.hit
+        start = time.perf_counter()
+        for user_id in users:
+            now += step
+            hit(user_id, now)
+        elapsed = time.perf_counter() - start
+        done += segment
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"{done:>10} {len(limiter):>9} {elapsed / segment * 1e9:>9.0f} {rss:>10.1f}")
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.first_name = f"user{user_id}"
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, bot, chat_id, text="", from_user=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.text = text
+        self.from_user = from_user
+        self.message_id = next(self._ids)
+
+    async def reply_text(self, text, **kwargs):
+        return await self.bot.send_message(self.chat_id, text, **kwargs)
+
+    async def reply_document(self, document, **kwargs):
+        return await self.bot.send_document(self.chat_id, document, **kwargs)
+
+
+class FakeCallbackQuery:
+    def __init__(self, bot, data, from_user, message):
+        self.bot = bot
+        self.data = data
+        self.from_user = from_user
+        self.message = message
+
+    async def answer(self, *args, **kwargs):
+        await self.bot.round_trip()
+        return True
+
+    async def edit_message_text(self, text, **kwargs):
+        await self.bot.round_trip()
+        self.message.text = text
+        self.message.reply_markup = kwargs.get("reply_markup")
+        return self.message
+
+
+class FakeUpdate:
+    def __init__(self, user, message=None, callback_query=None):
+        self.effective_user = user
+        self.message = message
+        self.callback_query = callback_query
+        self.effective_message = message or callback_query.message
+        self.effective_chat = None
+
+
+class FakeContext:
+    def __init__(self, bot):
+        self.bot = bot
+        self.args = []
+
+
+class FakeBot:
+    # Stands in for telegram.Bot: every API call costs one simulated round trip.
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.calls = 0
+
+    async def round_trip(self):
+        self.calls += 1
+        if self.rtt:
+            await asyncio.sleep(self.rtt)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self.round_trip()
+        message = FakeMessage(self, chat_id, text)
+        message.reply_markup = kwargs.get("reply_markup")
+        return message
+
+    async def send_document(self, chat_id, document, **kwargs):
+        await self.round_trip()
+        return FakeMessage(self, chat_id)
+
+    async def delete_message(self, chat_id, message_id, **kwargs):
+        await self.round_trip()
+        return True
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+async def run_handlers(args):
+    import bot
+    from password_generator import configure_rate_limit
+    from rate_limiter import SlidingWindowLimiter
+
+    if not args.rate_limit:
+        configure_rate_limit(SlidingWindowLimiter(10 ** 9, 60))
+    if bot.password_pool:
+        refill = asyncio.create_task(bot.password_pool.run())
+
+    fake_bot = FakeBot(args.rtt / 1000)
+    context = FakeContext(fake_bot)
+
+    def command(user, text):
+        message = FakeMessage(fake_bot, user.id, text, user)
+        return FakeUpdate(user, message=message)
+
+    def callback(user, data):
+        message = FakeMessage(fake_bot, user.id, "", user)
+        return FakeUpdate(user, callback_query=FakeCallbackQuery(fake_bot, data, user, message))
+
+    saved = {}
+
+    def scenario(user, rnd):
+        kind = rnd.choices(
+            ["/simple", "gen", "/save", "/mypasswords", "my_passwords", "/start"],
+            weights=[25, 30, 15, 15, 10, 5],
+        )[0]
+        if kind == "/simple":
+            return kind, bot.generate_command, command(user, f"/simple {rnd.randint(6, 20)}")
+        if kind == "gen":
+            level = rnd.choice(["simple", "medium", "strong"])
+            return "callback:gen", bot.callback_query_handler, callback(user, f"gen:{level}")
+        if kind == "/save":
+            saved[user.id] = saved.get(user.id, 0) + 1
+            text = f"/save account{saved[user.id]}@example.com password{rnd.randrange(10 ** 6)}"
+            return kind, bot.save_password, command(user, text)
+        if kind == "/mypasswords":
+            return kind, bot.my_passwords, command(user, kind)
+        if kind == "my_passwords":
+            return "callback:my_passwords", bot.callback_query_handler, callback(user, "my_passwords")
+        return kind, bot.start, command(user, kind)
+
+    latencies = {}
+
+    async def simulate_user(user_id):
+        user = FakeUser(user_id)
+        rnd = random.Random(user_id)
+        for _ in range(args.requests):
+            name, handler, update = scenario(user, rnd)
+            start = time.perf_counter()
+            await handler(update, context)
+            latencies.setdefault(name, []).append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(simulate_user(args.first_user + i) for i in range(args.users)))
+    elapsed = time.perf_counter() - start
+    if bot.password_pool:
+        refill.cancel()
+
+    total = sum(len(v) for v in latencies.values())
+    print(f"{args.users} users x {args.requests} requests, {elapsed:.2f}s, {total / elapsed:.0f} req/s, "
+          f"{fake_bot.calls} Bot API calls")
+    print(f"{'handler':<24} {'n':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        print(f"{name:<24} {len(values):>6} {len(values) / elapsed:>8.0f} "
+              f"{percentile(values, 0.5) * 1000:>8.2f} {percentile(values, 0.95) * 1000:>8.2f} "
+              f"{percentile(values, 0.99) * 1000:>8.2f}")
+    if bot.password_pool:
+        stats = bot.password_pool.stats()
+        print(f"password pool: {stats['hits']} hits, {stats['misses']} misses, hit rate {stats['hit_rate']:.1%}")
+
+
+def bench_handlers(args):
+    # bot.py reads its configuration at import time, so point it at a
+    # throwaway database before importing it.
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+        os.environ.setdefault("RATE_LIMIT_BACKEND", "memory")
+        asyncio.run(run_handlers(args))
+
+
+def bench_calibrate(args):
+    for algorithm in args.algorithm:
+        params, elapsed = calibrate_kdf(args.target / 1000, algorithm)
+        print(f"{algorithm}: {params.encode()} — {elapsed * 1000:.1f} ms на вывод ключа, "
+              f"до {1 / elapsed:.0f} входов в секунду на ядро")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки бота")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("storage", help="пропускная способность SecureStorage")
+    p.add_argument("--users", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    p.add_argument("--accounts", type=int, default=20)
+    p.add_argument("--write-ratio", type=float, default=0.1)
+    p.add_argument("--duration", type=float, default=2.0)
+    p.add_argument("--listing-cache", action="store_true", help="включить кэш списков учетных записей")
+    p.set_defaults(func=bench_storage)
+
+    p = sub.add_parser("ratelimit", help="задержка и память ограничителя запросов")
+    p.add_argument("--checks", type=int, default=2_000_000)
+    p.add_argument("--segments", type=int, default=5)
+    p.add_argument("--rate", type=float, default=2000.0, help="проверок в секунду (модельное время)")
+    p.add_argument("--active", type=int, default=1000)
+    p.add_argument("--new-every", type=int, default=2)
+    p.add_argument("--legacy", action="store_true", help="исходная реализация на списках")
+    p.set_defaults(func=bench_ratelimit)
+
+    p = sub.add_parser("handlers", help="нагрузочный тест обработчиков бота без Telegram")
+    p.add_argument("--users", type=int, default=100)
+    p.add_argument("--requests", type=int, default=20, help="запросов на пользователя")
+    p.add_argument("--rtt", type=float, default=0.0, help="имитация задержки Bot API, мс")
+    p.add_argument("--first-user", type=int, default=1_000_000)
+    p.add_argument("--rate-limit", action="store_true", help="включить обычный лимит запросов")
+    p.set_defaults(func=bench_handlers)
+
+    p = sub.add_parser("calibrate", help="подбор параметров KDF под целевую задержку")
+    p.add_argument("--target", type=float, default=100.0, help="целевое время вывода ключа, мс")
+    p.add_argument("--algorithm", nargs="+", default=["pbkdf2-sha256", "scrypt"],
+                   choices=["pbkdf2-sha256", "scrypt"])
+    p.set_defaults(func=bench_calibrate)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
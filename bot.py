@@ -1,8 +1,13 @@
+import io
 import os
+import asyncio
+import functools
+import tempfile
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -11,30 +16,180 @@ from telegram.ext import (
     MessageHandler,
     filters,
 )
+from telegram.request import HTTPXRequest
 
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
-if not BOT_TOKEN:
-    raise RuntimeError("Bot token not found. Please set the BOT_TOKEN environment variable.")
+DB_PATH = os.environ.get("DB_PATH", "passwords.db")
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "8"))
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
 
 from password_generator import (
     check_rate_limit,
+    configure_rate_limit,
+    RATE_LIMIT_MAX,
+    RATE_LIMIT_WINDOW,
     DEFAULTS,
-    generate_multiple_passwords
+    BULK_MAX,
+    PASSWORD_POOL_SIZE,
+    PASSWORD_POOL_LOW_WATER,
+    PasswordPools,
+    generate_multiple_passwords,
+    generate_passwords,
 )
 
-from secure_storage import SecureStorage
+from chat_cleaner import MessageLog, TrackingBot, delete_messages, DELETE_CONCURRENCY, TRACKED_PER_CHAT
+from metrics import metrics
+from rate_limiter import make_rate_limiter
+from secure_storage import (
+    SecureStorage,
+    AsyncSecureStorage,
+    KdfParams,
+    DEFAULT_KDF,
+    KEY_CACHE_SIZE,
+    KEY_CACHE_TTL,
+    LISTING_CACHE_SIZE,
+    LISTING_CACHE_TTL,
+    POOL_SIZE,
+    WRITE_BATCH_SIZE,
+    WRITE_BATCH_DELAY,
+)
+from rendering import (
+    PARSE_MODE,
+    START_TEXT,
+    HELP_TEXT,
+    EMPTY_VAULT_TEXT,
+    CLEAR_CONFIRM_TEXT,
+    CLEARED_TEXT,
+    BACK_KEYBOARD,
+    MAIN_MENU_KEYBOARD,
+    CLEAR_CONFIRM_KEYBOARD,
+    GENERATE_KEYBOARDS,
+    render_account,
+    render_found,
+    render_generated,
+    render_regenerated,
+    render_vault_page,
+    split_message,
+    vault_keyboard,
+)
+from update_processor import PerUserUpdateProcessor
+from vault_io import ImportFormatError, IMPORT_FORMATS, iter_import_rows, write_encrypted_export
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
 logger = logging.getLogger(__name__)
 
-secure_storage = SecureStorage()
+rate_limiter = make_rate_limiter(
+    os.environ.get("RATE_LIMIT_BACKEND", "memory"),
+    RATE_LIMIT_MAX,
+    RATE_LIMIT_WINDOW,
+    db_path=os.environ.get("RATE_LIMIT_DB", "ratelimit.db"),
+    fail_open=os.environ.get("RATE_LIMIT_FAIL_OPEN", "1") == "1",
+)
+configure_rate_limit(rate_limiter)
+
+IMPORT_MAX_BYTES = 5 * 1024 * 1024
+EXPORT_MIN_PASSPHRASE = 8
+EXPORT_SPOOL_BYTES = 1024 * 1024
+
+ADMIN_IDS = {int(x) for x in os.environ.get("ADMIN_IDS", "").replace(",", " ").split()}
+METRICS_FILE = os.environ.get("METRICS_FILE")
+METRICS_DUMP_INTERVAL = float(os.environ.get("METRICS_DUMP_INTERVAL", "15"))
+
+STORAGE_WORKERS = int(os.environ.get("STORAGE_WORKERS", "4"))
+KDF_EXECUTOR = os.environ.get("KDF_EXECUTOR", "thread")
+KDF_WORKERS = int(os.environ.get("KDF_WORKERS", "2"))
+KDF_ALGORITHM = os.environ.get("KDF_ALGORITHM", DEFAULT_KDF.algorithm)
+if KDF_ALGORITHM == "scrypt":
+    KDF_POLICY = KdfParams(
+        "scrypt",
+        int(os.environ.get("KDF_SCRYPT_N", 2 ** 14)),
+        int(os.environ.get("KDF_SCRYPT_R", 8)),
+        int(os.environ.get("KDF_SCRYPT_P", 1)),
+    )
+else:
+    KDF_POLICY = KdfParams(KDF_ALGORITHM, int(os.environ.get("KDF_ITERATIONS", DEFAULT_KDF.cost)))
+try:
+    KDF_POLICY.validate()
+except ValueError as e:
+    raise RuntimeError(f"Invalid KDF settings: {e}")
+
+# tracked: /clear deletes the messages recorded for the chat (both the bot's
+# and the user's); range: the CLEAR_RANGE message ids before the command.
+CLEAR_MODE = os.environ.get("CLEAR_MODE", "tracked")
+CLEAR_RANGE = int(os.environ.get("CLEAR_RANGE", "10"))
+CLEAR_CONCURRENCY = int(os.environ.get("CLEAR_CONCURRENCY", DELETE_CONCURRENCY))
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "256"))
+message_log = MessageLog(int(os.environ.get("CLEAR_TRACKED", TRACKED_PER_CHAT)))
+
+# Pre-generated passwords for the default lengths; PASSWORD_POOL=0 disables it.
+PASSWORD_POOL = int(os.environ.get("PASSWORD_POOL", PASSWORD_POOL_SIZE))
+password_pool = (
+    PasswordPools(PASSWORD_POOL, int(os.environ.get("PASSWORD_POOL_LOW_WATER", PASSWORD_POOL_LOW_WATER)))
+    if PASSWORD_POOL > 0 else None
+)
 
 
+def make_kdf_executor():
+    if KDF_EXECUTOR == "process":
+        return ProcessPoolExecutor(max_workers=KDF_WORKERS)
+    if KDF_EXECUTOR == "thread":
+        return ThreadPoolExecutor(max_workers=KDF_WORKERS, thread_name_prefix="kdf")
+    raise RuntimeError(f"Unknown KDF_EXECUTOR: {KDF_EXECUTOR}")
+
+
+secure_storage = AsyncSecureStorage(
+    SecureStorage(
+        DB_PATH,
+        key_cache_size=int(os.environ.get("KEY_CACHE_SIZE", KEY_CACHE_SIZE)),
+        key_cache_ttl=float(os.environ.get("KEY_CACHE_TTL", KEY_CACHE_TTL)),
+        pool_size=int(os.environ.get("DB_POOL_SIZE", POOL_SIZE)),
+        batch_writes=os.environ.get("WRITE_BATCH", "1") == "1",
+        batch_size=int(os.environ.get("WRITE_BATCH_SIZE", WRITE_BATCH_SIZE)),
+        batch_delay=float(os.environ.get("WRITE_BATCH_DELAY_MS", WRITE_BATCH_DELAY * 1000)) / 1000,
+        kdf_policy=KDF_POLICY,
+        listing_cache_size=int(os.environ.get("LISTING_CACHE_SIZE", LISTING_CACHE_SIZE)),
+        listing_cache_ttl=float(os.environ.get("LISTING_CACHE_TTL", LISTING_CACHE_TTL)),
+        listing_cache_encrypt=os.environ.get("LISTING_CACHE_ENCRYPT", "1") == "1",
+    ),
+    executor=ThreadPoolExecutor(max_workers=STORAGE_WORKERS, thread_name_prefix="storage"),
+    kdf_executor=make_kdf_executor(),
+)
+metrics.add_collector(lambda: {
+    f"key_cache_{name}": value
+    for name, value in secure_storage.storage.key_cache.stats().items()
+})
+metrics.add_collector(lambda: {
+    f"listing_cache_{name}": value
+    for name, value in secure_storage.storage.listing_cache.stats().items()
+})
+metrics.add_collector(lambda: {
+    "rate_limiter_entries": rate_limiter.cached_len(),
+    "rate_limiter_errors": getattr(rate_limiter, "errors", 0),
+})
+metrics.add_collector(lambda: {"clear_tracked_chats": len(message_log)})
+if password_pool:
+    metrics.add_collector(lambda: {
+        f"password_pool_{name}": value for name, value in password_pool.stats().items()
+    })
+
+
+def take_passwords(level: str, length: int, count: int = 3):
+    if password_pool:
+        return password_pool.take(level, length, count)
+    return generate_multiple_passwords(level, length, count)
+
+
+@metrics.timed("handler_seconds")
 async def save_password(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    if not check_rate_limit(user.id):
+    if not await check_rate_limit(user.id):
         await update.message.reply_text("⚠️ Слишком много запросов. Попробуйте чуть позже.")
         return
 
@@ -49,95 +204,286 @@ async def save_password(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         _, account, password = message_parts
         
-        if secure_storage.account_exists(user.id, account):
+        if not await secure_storage.save_password(user.id, account, password):
             await update.message.reply_text(
                 f"⚠️ Учетная запись '{account}' уже существует."
             )
             return
 
-        secure_storage.save_password(user.id, account, password)
         await update.message.reply_text(f"✅ Учетная запись '{account}' успешно сохранена!")
     except Exception as e:
         logger.error(f"Error in save_password: {e}")
         await update.message.reply_text("❌ Произошла ошибка при сохранении учетной записи.")
 
 
+async def build_passwords_page(user_id: int, cursor: int = 0, backward: bool = False, start: int = 1):
+    # Returns the page as a list of MarkdownV2 messages and the keyboard for the last one.
+    page = await secure_storage.get_passwords_page(user_id, cursor, backward=backward)
+    if not page.entries and cursor:
+        # The rows behind the cursor were deleted meanwhile: restart from the top.
+        page = await secure_storage.get_passwords_page(user_id)
+        start = 1
+    elif backward:
+        start = max(1, start - len(page.entries))
+
+    if not page.entries:
+        return None, BACK_KEYBOARD
+
+    return render_vault_page(page.entries, start), vault_keyboard(
+        f"pw:p:{page.prev_cursor}:{start}" if page.prev_cursor is not None else None,
+        f"pw:n:{page.next_cursor}:{start + len(page.entries)}" if page.next_cursor is not None else None,
+    )
+
+
+async def reply_chunks(message, chunks, reply_markup):
+    for chunk in chunks[:-1]:
+        await message.reply_text(chunk, parse_mode=PARSE_MODE)
+    await message.reply_text(chunks[-1], reply_markup=reply_markup, parse_mode=PARSE_MODE)
+
+
+async def edit_chunks(query, context, chunks, reply_markup):
+    # Only one message can be edited; the rest of a long page follows it as
+    # new messages, with the keyboard on the last one.
+    if len(chunks) == 1:
+        await query.edit_message_text(chunks[0], reply_markup=reply_markup, parse_mode=PARSE_MODE)
+        return
+    await query.edit_message_text(chunks[0], parse_mode=PARSE_MODE)
+    chat_id = query.message.chat_id
+    for chunk in chunks[1:-1]:
+        await context.bot.send_message(chat_id, chunk, parse_mode=PARSE_MODE)
+    await context.bot.send_message(chat_id, chunks[-1], reply_markup=reply_markup, parse_mode=PARSE_MODE)
+
+
+@metrics.timed("handler_seconds")
 async def my_passwords(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    if not check_rate_limit(user.id):
+    if not await check_rate_limit(user.id):
         await update.message.reply_text("⚠️ Слишком много запросов. Попробуйте чуть позже.")
         return
 
     try:
-        passwords = secure_storage.get_passwords(user.id)
+        chunks, reply_markup = await build_passwords_page(user.id)
+        if chunks is None:
+            await update.message.reply_text(EMPTY_VAULT_TEXT, reply_markup=reply_markup)
+        else:
+            await reply_chunks(update.message, chunks, reply_markup)
+    except Exception as e:
+        logger.error(f"Error in my_passwords: {e}")
+        await update.message.reply_text("❌ Произошла ошибка при загрузке ваших паролей.")
+
 
-        if not passwords:
-            await update.message.reply_text("📋 У вас пока нет сохраненных учетных записей.")
+@metrics.timed("handler_seconds")
+async def get_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not await check_rate_limit(user.id):
+        await update.message.reply_text("⚠️ Слишком много запросов. Попробуйте чуть позже.")
+        return
+
+    parts = update.message.text.split(' ', 1)
+    if len(parts) < 2 or not parts[1].strip():
+        await update.message.reply_text("❌ Неправильный формат. Используйте: /get <учетная_запись>")
+        return
+    account = parts[1].strip()
+
+    try:
+        entry = await secure_storage.get_password(user.id, account)
+        if entry is None:
+            await update.message.reply_text(f"❌ Учетная запись '{account}' не найдена. Поиск: /find <начало_названия>")
             return
+        await update.message.reply_text(render_account(entry), parse_mode=PARSE_MODE)
+    except Exception as e:
+        logger.error(f"Error in get_command: {e}")
+        await update.message.reply_text("❌ Произошла ошибка при загрузке учетной записи.")
 
-        response = "🔐 Ваши сохраненные учетные записи:\n\n"
-        for i, acc in enumerate(passwords, 1):
-            response += f"{i}. {acc['account']}\n   Пароль: `{acc['password']}`\n   Дата добавления: {acc['date_added']}\n\n"
 
-        await update.message.reply_text(response, parse_mode="Markdown")
+@metrics.timed("handler_seconds")
+async def find_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not await check_rate_limit(user.id):
+        await update.message.reply_text("⚠️ Слишком много запросов. Попробуйте чуть позже.")
+        return
+
+    parts = update.message.text.split(' ', 1)
+    if len(parts) < 2 or not parts[1].strip():
+        await update.message.reply_text("❌ Неправильный формат. Используйте: /find <начало_названия>")
+        return
+    prefix = parts[1].strip()
+
+    try:
+        entries, more = await secure_storage.find_accounts(user.id, prefix)
+        if not entries:
+            await update.message.reply_text(f"🔎 Ничего не найдено по запросу «{prefix}».")
+            return
+        await reply_chunks(update.message, render_found(prefix, entries, more), None)
     except Exception as e:
-        logger.error(f"Error in my_passwords: {e}")
-        await update.message.reply_text("❌ Произошла ошибка при загрузке ваших паролей.")
+        logger.error(f"Error in find_command: {e}")
+        await update.message.reply_text("❌ Произошла ошибка при поиске учетных записей.")
+
+
+@metrics.timed("handler_seconds")
+async def update_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not await check_rate_limit(user.id):
+        await update.message.reply_text("⚠️ Слишком много запросов. Попробуйте чуть позже.")
+        return
 
+    message_parts = update.message.text.split(' ', 2)
+    if len(message_parts) < 3:
+        await update.message.reply_text(
+            "❌ Неправильный формат. Используйте: /update <учетная_запись> <новый_пароль>\n"
+            "Пример: /update example@gmail.com newpassword456"
+        )
+        return
 
-LEVELS = [("Простой 🔰", "simple"), ("Средний ⚙️", "medium"), ("Сложный 🔒", "strong")]
+    try:
+        _, account, password = message_parts
+        if not await secure_storage.update_password(user.id, account, password):
+            await update.message.reply_text(f"❌ Учетная запись '{account}' не найдена.")
+            return
+        await update.message.reply_text(f"✅ Пароль учетной записи '{account}' обновлен!")
+    except Exception as e:
+        logger.error(f"Error in update_command: {e}")
+        await update.message.reply_text("❌ Произошла ошибка при обновлении пароля.")
 
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = (
-        "👋 Привет! Я бот для генерации безопасных паролей.\n\n"
-        "Я могу:\n"
-        "• Генерировать пароли различной сложности\n"
-        "• Сохранять ваши учетные записи с паролями\n"
-        "• Предоставлять быстрый доступ к сохраненным данным\n\n"
-        "Для просмотра всех команд используйте /help"
+@metrics.timed("handler_seconds")
+async def delete_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not await check_rate_limit(user.id):
+        await update.message.reply_text("⚠️ Слишком много запросов. Попробуйте чуть позже.")
+        return
+
+    parts = update.message.text.split(' ', 1)
+    if len(parts) < 2 or not parts[1].strip():
+        await update.message.reply_text("❌ Неправильный формат. Используйте: /delete <учетная_запись>")
+        return
+    account = parts[1].strip()
+
+    try:
+        if not await secure_storage.delete_password(user.id, account):
+            await update.message.reply_text(f"❌ Учетная запись '{account}' не найдена.")
+            return
+        await update.message.reply_text(f"🗑️ Учетная запись '{account}' удалена.")
+    except Exception as e:
+        logger.error(f"Error in delete_command: {e}")
+        await update.message.reply_text("❌ Произошла ошибка при удалении учетной записи.")
+
+
+@metrics.timed("handler_seconds")
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not await check_rate_limit(user.id):
+        await update.message.reply_text("⚠️ Слишком много запросов. Попробуйте чуть позже.")
+        return
+
+    await update.message.reply_text(
+        "📥 Отправьте файл с учетными записями:\n"
+        "• CSV — две колонки: учетная запись, пароль (строка заголовка account,password необязательна)\n"
+        "• JSON — массив вида [{\"account\": \"...\", \"password\": \"...\"}]\n"
+        "• JSONL — по одному такому объекту в строке\n\n"
+        "Уже существующие учетные записи не перезаписываются."
     )
-    keyboard = [
-        [InlineKeyboardButton(label, callback_data=f"gen:{code}") for label, code in LEVELS],
-        [InlineKeyboardButton("🔐 Мои пароли", callback_data="my_passwords")],
-        [InlineKeyboardButton("✉️ Группа ТГ", url="https://t.me/bot_creator161")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(text, reply_markup=reply_markup)
 
 
+@metrics.timed("handler_seconds")
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not await check_rate_limit(user.id):
+        await update.message.reply_text("⚠️ Слишком много запросов. Попробуйте чуть позже.")
+        return
+
+    document = update.message.document
+    try:
+        ext = os.path.splitext(document.file_name or "")[1].lower().lstrip(".")
+        if ext not in IMPORT_FORMATS:
+            await update.message.reply_text("❌ Поддерживаются только файлы CSV, JSON и JSONL. Подробнее: /import")
+            return
+        if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+            await update.message.reply_text(f"❌ Файл слишком большой (максимум {IMPORT_MAX_BYTES // 1024 // 1024} МБ).")
+            return
+
+        file = await document.get_file()
+        data = await file.download_as_bytearray()
+        try:
+            # The upload holds plaintext passwords, so do not leave it in the chat.
+            await update.message.delete()
+        except Exception:
+            pass
+
+        rows = iter_import_rows(io.BytesIO(data), document.file_name)
+        inserted, skipped = await secure_storage.import_passwords(user.id, rows)
+        await context.bot.send_message(
+            update.effective_chat.id,
+            f"✅ Импортировано учетных записей: {inserted}\n"
+            f"Пропущено (уже существуют): {skipped}"
+        )
+    except ImportFormatError as e:
+        await context.bot.send_message(update.effective_chat.id, f"❌ Не удалось разобрать файл: {e}")
+    except Exception as e:
+        logger.error(f"Error in import_document: {e}")
+        await context.bot.send_message(update.effective_chat.id, "❌ Произошла ошибка при импорте учетных записей.")
+
+
+@metrics.timed("handler_seconds")
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not await check_rate_limit(user.id):
+        await update.message.reply_text("⚠️ Слишком много запросов. Попробуйте чуть позже.")
+        return
+
+    parts = update.message.text.split(' ', 1)
+    if len(parts) < 2 or len(parts[1].strip()) < EXPORT_MIN_PASSPHRASE:
+        await update.message.reply_text(
+            f"❌ Неправильный формат. Используйте: /export <пароль_для_файла>\n"
+            f"Пароль для файла — не короче {EXPORT_MIN_PASSPHRASE} символов."
+        )
+        return
+    passphrase = parts[1].strip()
+    chat_id = update.effective_chat.id
+
+    try:
+        try:
+            # The command text contains the file passphrase.
+            await update.message.delete()
+        except Exception:
+            pass
+
+        with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES) as out:
+            count = await secure_storage.export_passwords(
+                user.id, functools.partial(write_encrypted_export, passphrase=passphrase, out=out)
+            )
+            if not count:
+                await context.bot.send_message(chat_id, EMPTY_VAULT_TEXT)
+                return
+            out.seek(0)
+            await context.bot.send_document(
+                chat_id,
+                out,
+                filename=f"passwords_{datetime.now():%Y%m%d}.enc",
+                caption=(
+                    f"🔐 Экспортировано учетных записей: {count}\n"
+                    "Файл зашифрован вашим паролем. Расшифровать: python vault_io.py decrypt <файл> <пароль>"
+                ),
+            )
+    except Exception as e:
+        logger.error(f"Error in export_command: {e}")
+        await context.bot.send_message(chat_id, "❌ Произошла ошибка при экспорте учетных записей.")
+
+
+@metrics.timed("handler_seconds")
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(START_TEXT, reply_markup=MAIN_MENU_KEYBOARD)
+
+
+@metrics.timed("handler_seconds")
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = (
-        "ℹ️ Список команд бота:\n\n"
-        "🔐 Генерация паролей:\n"
-        "/simple [длина] - простой пароль (буквы и цифры)\n"
-        "/medium [длина] - средний пароль (буквы разных регистров и цифры)\n"
-        "/strong [длина] - сложный пароль (буквы, цифры и символы)\n\n"
-        "📚 Управление учетными записями:\n"
-        "/save <учетная_запись> <пароль> - сохранить новую учетную запись\n"
-        "/mypasswords - посмотреть все сохраненные учетные записи\n\n"
-        "🧹 Дополнительно:\n"
-        "/clear - очистить чат (удалить последние сообщения)\n"
-        "/start - главное меню\n"
-        "/help - это сообщение\n\n"
-        "Примеры:\n"
-        "/simple 10\n"
-        "/medium 16\n"
-        "/strong 24\n"
-        "/save example@gmail.com mypassword123"
-    )
-    
-    keyboard = [
-        [InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(text, reply_markup=reply_markup)
+    await update.message.reply_text(HELP_TEXT, reply_markup=BACK_KEYBOARD)
 
 
+@metrics.timed("handler_seconds")
 async def generate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    if not check_rate_limit(user.id):
+    if not await check_rate_limit(user.id):
         await update.message.reply_text("⚠️ Слишком много запросов. Попробуйте чуть позже.")
         return
 
@@ -166,28 +512,79 @@ async def generate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-        passwords = generate_multiple_passwords(level, length, 3)
-        
-        keyboard = [
-            [InlineKeyboardButton("🔄 Сгенерировать еще", callback_data=f"gen:{level}")],
-            [InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        pwd_list = "\n".join([f"`{pwd}`" for pwd in passwords])
-        msg = f"🔐 Ваши пароли ({level}, длина {length}):\n\n{pwd_list}\n\nВыберите действие:"
-        await update.message.reply_text(msg, reply_markup=reply_markup, parse_mode="Markdown")
+        passwords = take_passwords(level, length)
+        await update.message.reply_text(
+            render_generated(level, length, passwords),
+            reply_markup=GENERATE_KEYBOARDS[level],
+            parse_mode=PARSE_MODE,
+        )
     except Exception as e:
         logger.error(f"Error in generate_command: {e}")
         await update.message.reply_text("❌ Произошла ошибка при генерации паролей.")
 
 
+@metrics.timed("handler_seconds")
+async def bulk_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if not await check_rate_limit(user.id):
+        await update.message.reply_text("⚠️ Слишком много запросов. Попробуйте чуть позже.")
+        return
+
+    parts = update.message.text.split()
+    if len(parts) < 3 or parts[1] not in DEFAULTS:
+        await update.message.reply_text(
+            "❌ Неправильный формат. Используйте: /bulk <simple|medium|strong> <количество> [длина]\n"
+            "Пример: /bulk strong 100 24"
+        )
+        return
+
+    level = parts[1]
+    try:
+        count = int(parts[2])
+        length = int(parts[3]) if len(parts) > 3 else DEFAULTS[level]["default"]
+    except ValueError:
+        await update.message.reply_text("Количество и длина должны быть числами.")
+        return
+
+    if not (1 <= count <= BULK_MAX):
+        await update.message.reply_text(f"Количество паролей: от 1 до {BULK_MAX}.")
+        return
+    if not (DEFAULTS[level]["min"] <= length <= DEFAULTS[level]["max"]):
+        await update.message.reply_text(
+            f"Допустимая длина: от {DEFAULTS[level]['min']} до {DEFAULTS[level]['max']}."
+        )
+        return
+
+    try:
+        passwords = generate_passwords(level, length, count)
+        document = io.BytesIO("\n".join(passwords).encode())
+        await update.message.reply_document(
+            document,
+            filename=f"passwords_{level}_{count}.txt",
+            caption=f"🔐 {count} паролей ({level}, длина {length})",
+        )
+    except Exception as e:
+        logger.error(f"Error in bulk_command: {e}")
+        await update.message.reply_text("❌ Произошла ошибка при генерации паролей.")
+
+
+# Callback data comes from the client unchecked, so only known branches become
+# metric labels; anything else is counted as "other".
+CALLBACK_BRANCHES = {"gen", "back_to_menu", "my_passwords", "pw", "clear_passwords", "confirm_clear"}
+
+
+def callback_branch(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+    branch = (update.callback_query.data or "").split(":")[0]
+    return "callback:" + (branch if branch in CALLBACK_BRANCHES else "other")
+
+
+@metrics.timed("handler_seconds", value=callback_branch)
 async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
     user = query.from_user
-    if not check_rate_limit(user.id):
+    if not await check_rate_limit(user.id):
         await query.edit_message_text("⚠️ Слишком много запросов. Попробуйте позже.")
         return
 
@@ -195,85 +592,47 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
     if data.startswith("gen:"):
         try:
             level = data.split(":")[1]
-            length = DEFAULTS[level]["default"]
-            passwords = generate_multiple_passwords(level, length, 3)
-            
-            keyboard = [
-                [InlineKeyboardButton("🔄 Сгенерировать еще", callback_data=f"gen:{level}")],
-                [InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            pwd_list = "\n".join([f"`{pwd}`" for pwd in passwords])
-            text = f"🔐 Сгенерированы пароли ({level}, длина {length}):\n\n{pwd_list}\n\nМожно указать длину: /{level} <число>"
-            await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+            passwords = take_passwords(level, DEFAULTS[level]["default"])
+            await query.edit_message_text(
+                render_regenerated(level, passwords),
+                reply_markup=GENERATE_KEYBOARDS[level],
+                parse_mode=PARSE_MODE,
+            )
         except Exception as e:
             logger.error(f"Error in gen handler: {e}")
             await query.edit_message_text("❌ Произошла ошибка при генерации паролей.")
     elif data == "back_to_menu":
         try:
-            text = (
-                "👋 Привет! Я бот для генерации безопасных паролей.\n\n"
-                "Я могу:\n"
-                "• Генерировать пароли различной сложности\n"
-                "• Сохранять ваши учетные записи с паролями\n"
-                "• Предоставлять быстрый доступ к сохраненным данным\n\n"
-                "Для просмотра всех команд используйте /help"
-            )
-            keyboard = [
-                [InlineKeyboardButton(label, callback_data=f"gen:{code}") for label, code in LEVELS],
-                [InlineKeyboardButton("🔐 Мои пароли", callback_data="my_passwords")],
-                [InlineKeyboardButton("✉️ Группа ТГ", url="https://t.me/bot_creator161")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(text, reply_markup=reply_markup)
+            await query.edit_message_text(START_TEXT, reply_markup=MAIN_MENU_KEYBOARD)
         except Exception as e:
             logger.error(f"Error in back_to_menu handler: {e}")
             await query.edit_message_text("Ошибка при возврате в меню.")
-    elif data == "my_passwords":
+    elif data == "my_passwords" or data.startswith("pw:"):
         try:
-            passwords = secure_storage.get_passwords(query.from_user.id)
-            
-            if not passwords:
-                text = "📋 У вас пока нет сохраненных учетных записей."
-                keyboard = [
-                    [InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")]
-                ]
+            if data.startswith("pw:"):
+                _, direction, cursor, start = data.split(":")
+                chunks, reply_markup = await build_passwords_page(
+                    query.from_user.id, int(cursor), backward=direction == "p", start=int(start)
+                )
             else:
-                text = "🔐 Ваши сохраненные учетные записи:\n\n"
-                for i, acc in enumerate(passwords, 1):
-                    text += f"{i}. {acc['account']}\n   Пароль: `{acc['password']}`\n   Дата добавления: {acc['date_added']}\n\n"
-                
-                keyboard = [
-                    [InlineKeyboardButton("🗑️ Очистить все", callback_data="clear_passwords")],
-                    [InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")]
-                ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+                chunks, reply_markup = await build_passwords_page(query.from_user.id)
+            if chunks is None:
+                await query.edit_message_text(EMPTY_VAULT_TEXT, reply_markup=reply_markup)
+            else:
+                await edit_chunks(query, context, chunks, reply_markup)
         except Exception as e:
             logger.error(f"Error in my_passwords handler: {e}")
             await query.edit_message_text("❌ Произошла ошибка при загрузке ваших паролей.")
     elif data == "clear_passwords":
         try:
-            keyboard = [
-                [InlineKeyboardButton("✅ Да, очистить", callback_data="confirm_clear")],
-                [InlineKeyboardButton("❌ Нет, вернуться", callback_data="my_passwords")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text("⚠️ Вы уверены, что хотите удалить все сохраненные учетные записи?", reply_markup=reply_markup)
+            await query.edit_message_text(CLEAR_CONFIRM_TEXT, reply_markup=CLEAR_CONFIRM_KEYBOARD)
         except Exception as e:
             logger.error(f"Error in clear_passwords handler: {e}")
             await query.edit_message_text("❌ Произошла ошибка при подготовке подтверждения очистки.")
     elif data == "confirm_clear":
         try:
-            secure_storage.delete_all_passwords(query.from_user.id)
-            text = "🗑️ Все сохраненные учетные записи успешно удалены."
-            keyboard = [
-                [InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(text, reply_markup=reply_markup)
+            await secure_storage.delete_all_passwords(query.from_user.id)
+            await query.edit_message_text(CLEARED_TEXT, reply_markup=BACK_KEYBOARD)
         except Exception as e:
             logger.error(f"Error in confirm_clear handler: {e}")
             await query.edit_message_text("❌ Произошла ошибка при очистке данных.")
@@ -284,54 +643,157 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
             logger.error(f"Error in unknown handler: {e}")
 
 
+async def track_incoming(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_message:
+        message_log.record(update.effective_message.chat_id, update.effective_message.message_id)
+
+
+@metrics.timed("handler_seconds")
 async def clear_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    if not check_rate_limit(user.id):
+    if not await check_rate_limit(user.id):
         await update.message.reply_text("⚠️ Слишком много запросов. Попробуйте чуть позже.")
         return
-    
+
     chat_id = update.effective_message.chat_id
-    
+    message_id = update.effective_message.message_id
+    message_ids = message_log.take(chat_id) if CLEAR_MODE == "tracked" else []
+    if not message_ids:
+        # Nothing recorded (e.g. right after a restart): fall back to the range.
+        message_ids = list(range(message_id - CLEAR_RANGE, message_id))
+
     try:
-        for message_id in range(update.effective_message.message_id - 1, 
-                                update.effective_message.message_id - 11, -1):
-            try:
-                await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-            except Exception:
-                continue
-        
-        try:
-            await context.bot.delete_message(chat_id=chat_id, message_id=update.effective_message.message_id)
-        except Exception:
-            pass
-        
-        temp_msg = await update.message.reply_text("🗑️ Чат очищен...")
-        await context.bot.delete_message(chat_id=chat_id, message_id=temp_msg.message_id)
+        deleted = await delete_messages(context.bot, chat_id, message_ids + [message_id], CLEAR_CONCURRENCY)
+        if not deleted:
+            await update.message.reply_text("⚠️ Не удалось очистить чат. Некоторые сообщения могут быть защищены от удаления.")
     except Exception as e:
+        logger.error(f"Error in clear_chat: {e}")
         await update.message.reply_text("⚠️ Не удалось очистить чат. Некоторые сообщения могут быть защищены от удаления.")
 
 
+@metrics.timed("handler_seconds")
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await unknown(update, context)
+        return
+
+    for chunk in split_message(metrics.render_text() or "Пока нет данных."):
+        await update.message.reply_text(chunk)
+
+
+@metrics.timed("handler_seconds")
 async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("❓ Не понял. Используйте /start для вызова меню.")
 
 
-def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+RATE_LIMIT_SWEEP_INTERVAL = 300
+LEGACY_MIGRATION_PAUSE = 0.5
+background_tasks = set()
+
+
+async def sweep_rate_limits():
+    while True:
+        await asyncio.sleep(RATE_LIMIT_SWEEP_INTERVAL)
+        evicted = await rate_limiter.sweep_async()
+        active = await rate_limiter.len_async()
+        if evicted:
+            logger.info(f"Rate limiter: evicted {evicted} idle users, {active} active")
 
+
+async def migrate_legacy_ciphertexts():
+    after_id, total = 0, 0
+    while after_id is not None:
+        converted, after_id = await secure_storage.migrate_legacy_rows(after_id)
+        total += converted
+        await asyncio.sleep(LEGACY_MIGRATION_PAUSE)
+    if total:
+        logger.info(f"Converted {total} stored passwords to the new ciphertext format")
+
+
+async def dump_metrics():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(METRICS_DUMP_INTERVAL)
+        try:
+            await loop.run_in_executor(None, metrics.dump, METRICS_FILE)
+        except Exception as e:
+            logger.error(f"Error writing metrics to {METRICS_FILE}: {e}")
+
+
+async def post_init(app):
+    tasks = [sweep_rate_limits(), migrate_legacy_ciphertexts()]
+    if password_pool:
+        tasks.append(password_pool.run())
+    if METRICS_FILE:
+        tasks.append(dump_metrics())
+    for coro in tasks:
+        task = asyncio.create_task(coro)
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+
+async def post_shutdown(app):
+    await asyncio.get_running_loop().run_in_executor(None, secure_storage.storage.close)
+
+
+def main():
+    if not BOT_TOKEN:
+        raise RuntimeError("Bot token not found. Please set the BOT_TOKEN environment variable.")
+
+    bot = TrackingBot(
+        BOT_TOKEN,
+        message_log=message_log,
+        request=HTTPXRequest(connection_pool_size=HTTP_POOL_SIZE),
+        get_updates_request=HTTPXRequest(),
+    )
+    builder = ApplicationBuilder().bot(bot).post_init(post_init).post_shutdown(post_shutdown)
+    if CONCURRENT_UPDATES > 1:
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+    app = builder.build()
+
+    if CLEAR_MODE == "tracked":
+        app.add_handler(MessageHandler(filters.ALL, track_incoming), group=-1)
+    elif CLEAR_MODE != "range":
+        raise RuntimeError(f"Unknown CLEAR_MODE: {CLEAR_MODE}")
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("simple", generate_command))
     app.add_handler(CommandHandler("medium", generate_command))
     app.add_handler(CommandHandler("strong", generate_command))
+    app.add_handler(CommandHandler("bulk", bulk_command))
     app.add_handler(CommandHandler("save", save_password))
     app.add_handler(CommandHandler("mypasswords", my_passwords))
+    app.add_handler(CommandHandler("get", get_command))
+    app.add_handler(CommandHandler("find", find_command))
+    app.add_handler(CommandHandler("update", update_command))
+    app.add_handler(CommandHandler("delete", delete_command))
+    app.add_handler(CommandHandler("import", import_command))
+    app.add_handler(CommandHandler("export", export_command))
+    app.add_handler(MessageHandler(filters.Document.ALL, import_document))
     app.add_handler(CommandHandler("clear", clear_chat))
+    app.add_handler(CommandHandler("stats", stats_command))
     app.add_handler(CallbackQueryHandler(callback_query_handler))
     app.add_handler(MessageHandler(filters.COMMAND, unknown))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, unknown))
 
-    logger.info("Бот запущен...")
-    app.run_polling(allowed_updates=["message", "callback_query"])
+    allowed_updates = ["message", "callback_query"]
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            raise RuntimeError("WEBHOOK_URL must be set when BOT_MODE=webhook.")
+        logger.info(f"Бот запущен (webhook {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH})...")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=allowed_updates,
+        )
+    elif BOT_MODE == "polling":
+        logger.info("Бот запущен...")
+        app.run_polling(allowed_updates=allowed_updates)
+    else:
+        raise RuntimeError(f"Unknown BOT_MODE: {BOT_MODE}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,108 @@
+import asyncio
+from collections import OrderedDict, deque
+from typing import Iterable, List
+
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import ExtBot
+
+from metrics import metrics
+
+TRACKED_PER_CHAT = 100
+TRACKED_CHATS = 10000
+DELETE_CONCURRENCY = 100
+DELETE_ATTEMPTS = 3
+DELETE_BATCH_MAX = 100  # Bot API limit for deleteMessages
+
+
+class MessageLog:
+    # Last per_chat message ids of every chat, for at most max_chats chats
+    # (least recently active chats are dropped first).
+    def __init__(self, per_chat: int = TRACKED_PER_CHAT, max_chats: int = TRACKED_CHATS):
+        self.per_chat = per_chat
+        self.max_chats = max_chats
+        self._chats = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def record(self, chat_id: int, message_id: int):
+        ids = self._chats.get(chat_id)
+        if ids is None:
+            ids = self._chats[chat_id] = deque(maxlen=self.per_chat)
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        ids.append(message_id)
+
+    def take(self, chat_id: int) -> List[int]:
+        ids = self._chats.pop(chat_id, None)
+        return list(ids) if ids else []
+
+
+# Records the ids of messages the bot sends, so /clear knows exactly what to
+# delete instead of guessing from the command's message id.
+class TrackingBot(ExtBot):
+    __slots__ = ("message_log",)
+
+    def __init__(self, *args, message_log: MessageLog, **kwargs):
+        super().__init__(*args, **kwargs)
+        with self._unfrozen():
+            self.message_log = message_log
+
+    def _track(self, message):
+        self.message_log.record(message.chat_id, message.message_id)
+        return message
+
+    async def send_message(self, *args, **kwargs):
+        return self._track(await super().send_message(*args, **kwargs))
+
+    async def send_document(self, *args, **kwargs):
+        return self._track(await super().send_document(*args, **kwargs))
+
+
+async def delete_messages(bot, chat_id: int, message_ids: Iterable[int],
+                          concurrency: int = DELETE_CONCURRENCY) -> int:
+    # Returns the number of deleted messages. Uses the batch deleteMessages
+    # method when the library has it, otherwise deleteMessage calls run
+    # concurrently (at most concurrency at a time). A RetryAfter pauses all
+    # pending calls, not just the one that hit the flood limit.
+    message_ids = sorted(set(message_ids))
+    if not message_ids:
+        return 0
+    loop = asyncio.get_running_loop()
+    resume_at = 0.0
+
+    async def call(method, *args):
+        nonlocal resume_at
+        for attempt in range(DELETE_ATTEMPTS):
+            delay = resume_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await method(chat_id, *args)
+            except RetryAfter as e:
+                metrics.inc("clear_retry_after_total")
+                resume_at = max(resume_at, loop.time() + e.retry_after)
+            except TelegramError:
+                # Too old, already deleted or not ours: nothing to retry.
+                return False
+        return False
+
+    if hasattr(bot, "delete_messages"):
+        batches = [message_ids[i:i + DELETE_BATCH_MAX] for i in range(0, len(message_ids), DELETE_BATCH_MAX)]
+        results = await asyncio.gather(*(call(bot.delete_messages, batch) for batch in batches))
+        deleted = sum(len(batch) for batch, ok in zip(batches, results) if ok)
+    else:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def delete_one(message_id):
+            async with semaphore:
+                return await call(bot.delete_message, message_id)
+
+        results = await asyncio.gather(*map(delete_one, message_ids))
+        deleted = sum(1 for ok in results if ok)
+
+    metrics.inc("clear_deleted_messages_total", deleted)
+    metrics.inc("clear_failed_messages_total", len(message_ids) - deleted)
+    return deleted
@@ -0,0 +1,193 @@
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Tuple
+
+# Upper bounds in seconds; the last bucket (+Inf) catches everything else.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+PREFIX = "crypto_bot_"
+
+# Labels of the innermost timed() call, so nested phase timers can be
+# attributed to the storage method they run in.
+_scope = contextvars.ContextVar("metrics_scope", default=())
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-th observation.
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+def _key(name: str, labels: dict) -> Tuple[str, tuple]:
+    return name, tuple(sorted(labels.items()))
+
+
+def _escape_label(value) -> str:
+    # Prometheus text format: backslash, double quote and newline are escaped.
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple, extra: str = "") -> str:
+    parts = [f'{k}="{_escape_label(v)}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _text_labels(labels: tuple) -> str:
+    return "[" + ",".join(f"{k}={v}" for k, v in labels) + "]" if labels else ""
+
+
+class Registry:
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, tuple], Histogram] = {}
+        self.counters: Dict[Tuple[str, tuple], int] = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(value)
+
+    def inc(self, name: str, amount: int = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def add_collector(self, collector: Callable[[], Dict[str, float]]):
+        # Collectors return current gauge values (e.g. cache sizes) on demand.
+        self.collectors.append(collector)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def phase(self, name: str, phase: str):
+        with self.timer(name, phase=phase, **dict(_scope.get())):
+            yield
+
+    def timed(self, name: str, label: str = "handler", value=None):
+        # Decorates sync or async callables. value may be a string or a
+        # function of the call arguments returning the label value.
+        def decorator(func):
+            def label_value(args, kwargs):
+                if value is None:
+                    return func.__name__
+                return value(*args, **kwargs) if callable(value) else value
+
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def wrapper(*args, **kwargs):
+                    with self.timer(name, **{label: label_value(args, kwargs)}):
+                        return await func(*args, **kwargs)
+            else:
+                @functools.wraps(func)
+                def wrapper(*args, **kwargs):
+                    labels = {label: label_value(args, kwargs)}
+                    token = _scope.set(tuple(labels.items()))
+                    try:
+                        with self.timer(name, **labels):
+                            return func(*args, **kwargs)
+                    finally:
+                        _scope.reset(token)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        with self._lock:
+            histograms = {
+                key: (list(h.counts), h.count, h.sum) for key, h in self.histograms.items()
+            }
+            counters = dict(self.counters)
+        gauges = {}
+        for collector in self.collectors:
+            gauges.update(collector())
+        return histograms, counters, gauges
+
+    def render_text(self) -> str:
+        histograms, counters, gauges = self.snapshot()
+        lines = []
+        for (name, labels), (counts, count, total) in sorted(histograms.items()):
+            hist = Histogram()
+            hist.counts, hist.count, hist.sum = counts, count, total
+            lines.append(
+                f"{name}{_text_labels(labels)} n={count} avg={total / count * 1000:.2f}ms "
+                f"p50={hist.quantile(0.5) * 1000:g}ms p95={hist.quantile(0.95) * 1000:g}ms "
+                f"p99={hist.quantile(0.99) * 1000:g}ms"
+            )
+        for (name, labels), n in sorted(counters.items()):
+            lines.append(f"{name}{_text_labels(labels)} {n}")
+        for name, v in sorted(gauges.items()):
+            lines.append(f"{name} {v:g}")
+        return "\n".join(lines)
+
+    def render_prometheus(self) -> str:
+        histograms, counters, gauges = self.snapshot()
+        lines = []
+        typed = set()
+        for (name, labels), (counts, count, total) in sorted(histograms.items()):
+            metric = PREFIX + name
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, n in zip(BUCKETS + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                le_label = f'le="{le}"'
+                lines.append(f"{metric}_bucket{_format_labels(labels, le_label)} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {count}")
+        for (name, labels), n in sorted(counters.items()):
+            metric = PREFIX + name
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_format_labels(labels)} {n}")
+        for name, v in sorted(gauges.items()):
+            lines.append(f"# TYPE {PREFIX + name} gauge")
+            lines.append(f"{PREFIX + name} {v}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp, path)
+
+
+metrics = Registry()
@@ -1,30 +1,38 @@
-import time
+import asyncio
 import string
 import secrets
-from typing import List
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from metrics import metrics
+from rate_limiter import RateLimitBackend, SlidingWindowLimiter
 
 RATE_LIMIT_MAX = 15
 RATE_LIMIT_WINDOW = 60
-_user_requests = {}
+rate_limiter = SlidingWindowLimiter(RATE_LIMIT_MAX, RATE_LIMIT_WINDOW)
 
 DEFAULTS = {
     "simple": {"default": 8, "min": 4, "max": 32},
     "medium": {"default": 12, "min": 6, "max": 64},
     "strong": {"default": 20, "min": 8, "max": 128},
 }
+BULK_MAX = 5000
+PASSWORD_POOL_SIZE = 300
+PASSWORD_POOL_LOW_WATER = 100
+
+def configure_rate_limit(backend: RateLimitBackend):
+    global rate_limiter
+    rate_limiter = backend
+
 
-def check_rate_limit(user_id: int) -> bool:
-    now = time.time()
-    ts_list = _user_requests.get(user_id, [])
-    ts_list = [t for t in ts_list if now - t < RATE_LIMIT_WINDOW]
-    if len(ts_list) >= RATE_LIMIT_MAX:
-        _user_requests[user_id] = ts_list
-        return False
-    ts_list.append(now)
-    _user_requests[user_id] = ts_list
-    return True
+async def check_rate_limit(user_id: int) -> bool:
+    if await rate_limiter.hit_async(user_id):
+        return True
+    metrics.inc("rate_limit_rejections_total")
+    return False
 
 
+@lru_cache(maxsize=None)
 def make_charset(level: str, exclude_ambiguous: bool = True) -> str:
     AMBIG = {'l', 'I', '1', 'O', '0'}
     lower = string.ascii_lowercase
@@ -47,10 +55,118 @@ def make_charset(level: str, exclude_ambiguous: bool = True) -> str:
         raise ValueError("Неизвестный уровень сложности")
 
 
+@lru_cache(maxsize=None)
+def _translation(level: str, exclude_ambiguous: bool) -> Tuple[bytes, bytes, float]:
+    # Random bytes >= limit are rejected so that every character of the
+    # charset is hit by exactly limit / n byte values (no modulo bias).
+    charset = make_charset(level, exclude_ambiguous).encode("ascii")
+    n = len(charset)
+    limit = 256 - 256 % n
+    table = bytes(charset[b % n] if b < limit else 0 for b in range(256))
+    rejected = bytes(range(limit, 256))
+    return table, rejected, limit / 256
+
+
+def _random_chars(level: str, needed: int, exclude_ambiguous: bool = True) -> bytearray:
+    table, rejected, accept_ratio = _translation(level, exclude_ambiguous)
+    chars = bytearray()
+    while len(chars) < needed:
+        missing = needed - len(chars)
+        buf = secrets.token_bytes(int(missing / accept_ratio) + 16)
+        chars += buf.translate(table, rejected)
+    del chars[needed:]
+    return chars
+
+
+def generate_passwords(level: str, length: int, count: int, exclude_ambiguous: bool = True) -> List[str]:
+    needed = length * count
+    text = _random_chars(level, needed, exclude_ambiguous).decode("ascii")
+    return [text[i:i + length] for i in range(0, needed, length)]
+
+
 def generate_password(level: str, length: int) -> str:
-    charset = make_charset(level)
-    return ''.join(secrets.choice(charset) for _ in range(length))
+    return generate_passwords(level, length, 1)[0]
 
 
 def generate_multiple_passwords(level: str, length: int, count: int = 3) -> List[str]:
-    return [generate_password(level, length) for _ in range(count)]
\ No newline at end of file
+    return generate_passwords(level, length, count)
+
+class PasswordPool:
+    # Pre-generated passwords of one level and length, stored back to back in
+    # one buffer. Passwords are taken from the end and their bytes zeroed, so
+    # each one is handed out exactly once.
+    def __init__(self, level: str, length: int, size: int):
+        self.level = level
+        self.length = length
+        self.size = size
+        self._buf = bytearray()
+
+    def __len__(self) -> int:
+        return len(self._buf) // self.length
+
+    def take(self, count: int) -> Optional[List[str]]:
+        needed = count * self.length
+        if len(self._buf) < needed:
+            return None
+        with memoryview(self._buf) as view:
+            text = str(view[-needed:], "ascii")
+        self._buf[-needed:] = bytes(needed)
+        del self._buf[-needed:]
+        return [text[i:i + self.length] for i in range(0, needed, self.length)]
+
+    def fill(self) -> int:
+        missing = self.size - len(self)
+        if missing > 0:
+            chars = _random_chars(self.level, missing * self.length)
+            self._buf += chars
+            chars[:] = bytes(len(chars))
+        return max(missing, 0)
+
+
+# One pool per level at its default length, refilled by a background task
+# whenever a pool drops below low_water. Other lengths, and requests that
+# find a pool empty, are generated on the spot.
+class PasswordPools:
+    def __init__(self, size: int = PASSWORD_POOL_SIZE, low_water: int = PASSWORD_POOL_LOW_WATER):
+        self.pools: Dict[str, PasswordPool] = {
+            level: PasswordPool(level, params["default"], size) for level, params in DEFAULTS.items()
+        }
+        self.low_water = low_water
+        self.hits = 0
+        self.misses = 0
+        self._wake: Optional[asyncio.Event] = None
+
+    def take(self, level: str, length: int, count: int) -> List[str]:
+        pool = self.pools.get(level)
+        if pool is None or pool.length != length:
+            return generate_passwords(level, length, count)
+        passwords = pool.take(count)
+        if len(pool) < self.low_water and self._wake is not None:
+            self._wake.set()
+        if passwords is None:
+            self.misses += 1
+            return generate_passwords(level, length, count)
+        self.hits += 1
+        return passwords
+
+    async def run(self):
+        self._wake = asyncio.Event()
+        while True:
+            for pool in self.pools.values():
+                pool.fill()
+                # Yield between levels so that a refill never holds the loop
+                # for more than one pool's worth of generation.
+                await asyncio.sleep(0)
+            await self._wake.wait()
+            self._wake.clear()
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+        for level, pool in self.pools.items():
+            stats[f"available_{level}"] = len(pool)
+        return stats
@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Hashable, Optional
+
+SWEEP_BATCH = 8
+SQLITE_BUSY_TIMEOUT = 5.0
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitBackend:
+    max_requests: int
+    window: float
+
+    def hit(self, key: Hashable, now: Optional[float] = None) -> bool:
+        raise NotImplementedError
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        return 0
+
+    # Called from the event loop; backends that may block override these.
+    async def hit_async(self, key: Hashable, now: Optional[float] = None) -> bool:
+        return self.hit(key, now)
+
+    async def sweep_async(self, now: Optional[float] = None) -> int:
+        return self.sweep(now)
+
+    async def len_async(self) -> int:
+        return len(self)
+
+    # Entry count for metrics; must not block, so it may lag behind.
+    def cached_len(self) -> int:
+        return len(self)
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def _slide(start: float, current: int, previous: int, now: float, window: float):
+    elapsed = now - start
+    if elapsed >= window:
+        periods = int(elapsed // window)
+        previous = current if periods == 1 else 0
+        current = 0
+        start += periods * window
+        elapsed -= periods * window
+    estimated = previous * (window - elapsed) / window + current
+    return start, current, previous, estimated
+
+
+class _Window:
+    __slots__ = ("start", "current", "previous", "last_seen")
+
+    def __init__(self, now: float):
+        self.start = now
+        self.current = 0
+        self.previous = 0
+        self.last_seen = now
+
+
+# Sliding-window counter: two integers per key instead of a timestamp log.
+# The rate is estimated as previous * overlap + current, where overlap is the
+# share of the previous fixed window still covered by the sliding one. Keys are
+# kept in least-recently-seen order, so idle entries sit at the front and each
+# one is evicted in O(1).
+class SlidingWindowLimiter(RateLimitBackend):
+    def __init__(self, max_requests: int, window: float, sweep_batch: int = SWEEP_BATCH):
+        self.max_requests = max_requests
+        self.window = window
+        self.idle_after = 2 * window
+        self.sweep_batch = sweep_batch
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def hit(self, key: Hashable, now: Optional[float] = None) -> bool:
+        if now is None:
+            now = time.monotonic()
+        self._evict_idle(now, self.sweep_batch)
+
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Window(now)
+        else:
+            self._entries.move_to_end(key)
+        entry.last_seen = now
+
+        entry.start, entry.current, entry.previous, estimated = _slide(
+            entry.start, entry.current, entry.previous, now, self.window
+        )
+        if estimated >= self.max_requests:
+            return False
+        entry.current += 1
+        return True
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        if now is None:
+            now = time.monotonic()
+        return self._evict_idle(now, len(self._entries))
+
+    def _evict_idle(self, now: float, limit: int) -> int:
+        evicted = 0
+        entries = self._entries
+        while evicted < limit and entries:
+            key = next(iter(entries))
+            if now - entries[key].last_seen < self.idle_after:
+                break
+            del entries[key]
+            evicted += 1
+        self.evictions += evicted
+        return evicted
+
+
+# Same sliding-window counter, kept in a SQLite file so that several bot
+# processes on one host share a single limit and survive restarts. Each check
+# is one BEGIN IMMEDIATE transaction, which makes read-modify-write atomic
+# across processes. Timestamps are wall-clock because monotonic clocks are
+# not comparable between processes.
+#
+# A check may wait up to SQLITE_BUSY_TIMEOUT for another process's write
+# lock, so the async methods run on a dedicated thread. If the database stays
+# locked (or fails otherwise) the check fails open or closed as configured
+# instead of raising into the handler.
+class SQLiteRateLimitBackend(RateLimitBackend):
+    def __init__(self, db_path: str, max_requests: int, window: float, fail_open: bool = True):
+        self.db_path = db_path
+        self.max_requests = max_requests
+        self.window = window
+        self.idle_after = 2 * window
+        self.fail_open = fail_open
+        self.errors = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ratelimit")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            db_path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                key TEXT PRIMARY KEY,
+                start REAL NOT NULL,
+                current INTEGER NOT NULL,
+                previous INTEGER NOT NULL,
+                last_seen REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_rate_limits_last_seen ON rate_limits (last_seen)")
+        # Refreshed by len_async(); __len__ counts the whole table.
+        self._entries = len(self)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0]
+
+    def hit(self, key: Hashable, now: Optional[float] = None) -> bool:
+        if now is None:
+            now = time.time()
+        key = str(key)
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT start, current, previous FROM rate_limits WHERE key = ?", (key,)
+                ).fetchone()
+                start, current, previous = row if row else (now, 0, 0)
+                start, current, previous, estimated = _slide(start, current, previous, now, self.window)
+                allowed = estimated < self.max_requests
+                if allowed:
+                    current += 1
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (key, start, current, previous, last_seen) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, start, current, previous, now)
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return allowed
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        if now is None:
+            now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM rate_limits WHERE last_seen < ?", (now - self.idle_after,)
+            )
+            return cursor.rowcount
+
+    async def hit_async(self, key: Hashable, now: Optional[float] = None) -> bool:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, self.hit, key, now)
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.error(f"Error checking rate limit for {key}: {e}")
+            return self.fail_open
+
+    async def sweep_async(self, now: Optional[float] = None) -> int:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, self.sweep, now)
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.error(f"Error sweeping rate limits: {e}")
+            return 0
+
+    async def len_async(self) -> int:
+        loop = asyncio.get_running_loop()
+        try:
+            self._entries = await loop.run_in_executor(self._executor, len, self)
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.error(f"Error counting rate limits: {e}")
+        return self._entries
+
+    def cached_len(self) -> int:
+        return self._entries
+
+    def close(self):
+        self._executor.shutdown()
+        with self._lock:
+            self._conn.close()
+
+
+def make_rate_limiter(backend: str, max_requests: int, window: float,
+                      db_path: str = "ratelimit.db", fail_open: bool = True) -> RateLimitBackend:
+    if backend == "memory":
+        return SlidingWindowLimiter(max_requests, window)
+    if backend == "sqlite":
+        return SQLiteRateLimitBackend(db_path, max_requests, window, fail_open)
+    raise ValueError(f"Unknown rate limit backend: {backend}")
@@ -0,0 +1,189 @@
+from typing import Iterable, List, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from password_generator import DEFAULTS
+
+MAX_MESSAGE_LENGTH = 4096
+PARSE_MODE = "MarkdownV2"
+
+# MarkdownV2 reserves these characters everywhere outside code entities;
+# inside `code` only the backtick and the backslash have to be escaped.
+_MD_TABLE = str.maketrans({ch: "\\" + ch for ch in "\\_*[]()~`>#+-=|{}.!"})
+_CODE_TABLE = str.maketrans({"\\": "\\\\", "`": "\\`"})
+
+
+def escape_md(text: str) -> str:
+    return str(text).translate(_MD_TABLE)
+
+
+def code(text: str) -> str:
+    return "`" + str(text).translate(_CODE_TABLE) + "`"
+
+
+def _split_block(block: str, limit: int) -> Iterable[str]:
+    # Last resort for a single block longer than a message: cut it, but never
+    # right after an escaping backslash.
+    while len(block) > limit:
+        cut = limit
+        while cut > 1 and block[cut - 1] == "\\":
+            cut -= 1
+        yield block[:cut]
+        block = block[cut:]
+    yield block
+
+
+def pack(blocks: Iterable[str], sep: str = "\n", limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    # Greedily joins blocks into as few messages as possible. Blocks are
+    # never split unless one alone is over the limit, so formatting entities
+    # inside a block stay intact.
+    chunks = []
+    current, size = [], 0
+    for block in blocks:
+        for part in _split_block(block, limit):
+            extra = len(part) + (len(sep) if current else 0)
+            if current and size + extra > limit:
+                chunks.append(sep.join(current))
+                current, size = [], 0
+                extra = len(part)
+            current.append(part)
+            size += extra
+    if current:
+        chunks.append(sep.join(current))
+    return chunks
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    return pack(text.split("\n"), "\n", limit)
+
+
+LEVELS = [("Простой 🔰", "simple"), ("Средний ⚙️", "medium"), ("Сложный 🔒", "strong")]
+
+START_TEXT = (
+    "👋 Привет! Я бот для генерации безопасных паролей.\n\n"
+    "Я могу:\n"
+    "• Генерировать пароли различной сложности\n"
+    "• Сохранять ваши учетные записи с паролями\n"
+    "• Предоставлять быстрый доступ к сохраненным данным\n\n"
+    "Для просмотра всех команд используйте /help"
+)
+
+HELP_TEXT = (
+    "ℹ️ Список команд бота:\n\n"
+    "🔐 Генерация паролей:\n"
+    "/simple [длина] - простой пароль (буквы и цифры)\n"
+    "/medium [длина] - средний пароль (буквы разных регистров и цифры)\n"
+    "/strong [длина] - сложный пароль (буквы, цифры и символы)\n"
+    "/bulk <уровень> <количество> [длина] - файл с множеством паролей\n\n"
+    "📚 Управление учетными записями:\n"
+    "/save <учетная_запись> <пароль> - сохранить новую учетную запись\n"
+    "/mypasswords - посмотреть все сохраненные учетные записи\n"
+    "/get <учетная_запись> - показать пароль одной учетной записи\n"
+    "/find <начало_названия> - найти учетные записи\n"
+    "/update <учетная_запись> <пароль> - изменить пароль\n"
+    "/delete <учетная_запись> - удалить учетную запись\n"
+    "/import - загрузить учетные записи из файла CSV/JSON\n"
+    "/export <пароль_для_файла> - получить зашифрованный файл со всеми записями\n\n"
+    "🧹 Дополнительно:\n"
+    "/clear - очистить чат (удалить последние сообщения)\n"
+    "/start - главное меню\n"
+    "/help - это сообщение\n\n"
+    "Примеры:\n"
+    "/simple 10\n"
+    "/medium 16\n"
+    "/strong 24\n"
+    "/save example@gmail.com mypassword123"
+)
+
+EMPTY_VAULT_TEXT = "📋 У вас пока нет сохраненных учетных записей."
+CLEAR_CONFIRM_TEXT = "⚠️ Вы уверены, что хотите удалить все сохраненные учетные записи?"
+CLEARED_TEXT = "🗑️ Все сохраненные учетные записи успешно удалены."
+
+# Keyboards never change, so they are built once and shared by all updates
+# (telegram objects are immutable).
+BACK_BUTTON = InlineKeyboardButton("🔙 Назад", callback_data="back_to_menu")
+BACK_KEYBOARD = InlineKeyboardMarkup([[BACK_BUTTON]])
+MAIN_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton(label, callback_data=f"gen:{level}") for label, level in LEVELS],
+    [InlineKeyboardButton("🔐 Мои пароли", callback_data="my_passwords")],
+    [InlineKeyboardButton("✉️ Группа ТГ", url="https://t.me/bot_creator161")],
+])
+CLEAR_CONFIRM_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Да, очистить", callback_data="confirm_clear")],
+    [InlineKeyboardButton("❌ Нет, вернуться", callback_data="my_passwords")],
+])
+GENERATE_KEYBOARDS = {
+    level: InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Сгенерировать еще", callback_data=f"gen:{level}")],
+        [BACK_BUTTON],
+    ])
+    for level in DEFAULTS
+}
+_VAULT_ACTION_ROWS = [
+    [InlineKeyboardButton("🗑️ Очистить все", callback_data="clear_passwords")],
+    [BACK_BUTTON],
+]
+VAULT_KEYBOARD = InlineKeyboardMarkup(_VAULT_ACTION_ROWS)
+
+# Escaped once; only the passwords (and the length for commands) vary.
+_GENERATED_FOOTER = escape_md("Выберите действие:")
+_REGENERATED = {
+    level: (
+        escape_md(f"🔐 Сгенерированы пароли ({level}, длина {DEFAULTS[level]['default']}):"),
+        escape_md(f"Можно указать длину: /{level} <число>"),
+    )
+    for level in DEFAULTS
+}
+_VAULT_HEADER = escape_md("🔐 Ваши сохраненные учетные записи:") + "\n"
+
+
+def render_generated(level: str, length: int, passwords: Iterable[str]) -> str:
+    header = f"🔐 Ваши пароли \\({level}, длина {length}\\):"
+    return "\n".join([header, "", *map(code, passwords), "", _GENERATED_FOOTER])
+
+
+def render_regenerated(level: str, passwords: Iterable[str]) -> str:
+    header, footer = _REGENERATED[level]
+    return "\n".join([header, "", *map(code, passwords), "", footer])
+
+
+def render_vault_entry(index: int, entry: dict) -> str:
+    return (
+        f"{index}\\. {escape_md(entry['account'])}\n"
+        f"   Пароль: {code(entry['password'])}\n"
+        f"   Дата добавления: {escape_md(entry['date_added'])}\n"
+    )
+
+
+def render_vault_page(entries: List[dict], start: int) -> List[str]:
+    blocks = [_VAULT_HEADER]
+    blocks.extend(render_vault_entry(i, entry) for i, entry in enumerate(entries, start))
+    return pack(blocks)
+
+
+def vault_keyboard(prev_data: Optional[str], next_data: Optional[str]) -> InlineKeyboardMarkup:
+    if prev_data is None and next_data is None:
+        return VAULT_KEYBOARD
+    nav = []
+    if prev_data is not None:
+        nav.append(InlineKeyboardButton("⬅️ Пред.", callback_data=prev_data))
+    if next_data is not None:
+        nav.append(InlineKeyboardButton("След. ➡️", callback_data=next_data))
+    return InlineKeyboardMarkup([nav, *_VAULT_ACTION_ROWS])
+
+
+def render_account(entry: dict) -> str:
+    return (
+        f"🔐 {escape_md(entry['account'])}\n"
+        f"Пароль: {code(entry['password'])}\n"
+        f"Дата добавления: {escape_md(entry['date_added'])}"
+    )
+
+
+def render_found(prefix: str, entries: List[dict], more: bool) -> List[str]:
+    blocks = [escape_md(f"🔎 Найдено по запросу «{prefix}»:") + "\n"]
+    blocks.extend(f"• {code(entry['account'])}" for entry in entries)
+    if more:
+        blocks.append("\n" + escape_md("Показаны не все совпадения — уточните запрос."))
+    blocks.append("\n" + escape_md("Пароль учетной записи: /get <учетная_запись>"))
+    return pack(blocks)
@@ -1,22 +1,699 @@
+import os
 import sqlite3
 import threading
 import base64
+import time
+import asyncio
+import functools
+import itertools
+import json
+import queue
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Executor, Future
 from datetime import datetime
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+from metrics import metrics
+
+KEY_CACHE_SIZE = 1024
+KEY_CACHE_TTL = 600
+LISTING_CACHE_SIZE = 1024
+LISTING_CACHE_TTL = 30
+LISTING_CACHE_PER_USER = 16
+POOL_SIZE = 8
+LOCK_STRIPES = 64
+BUSY_TIMEOUT = 30.0
+PAGE_SIZE = 10
+FIND_LIMIT = 20
+KDF_SALT = b'salt_12345678'
+KDF_ITERATIONS = 100000
+SALT_SIZE = 16
+REWRAP_ATTEMPTS = 3
+CIPHERTEXT_V2 = 2
+NONCE_SIZE = 12
+MIGRATION_BATCH = 500
+WRITE_BATCH_SIZE = 64
+WRITE_BATCH_DELAY = 0.005
+IMPORT_BATCH = 500
+EXPORT_BATCH = 200
+
+
+def derive_key(password: str, salt: bytes = KDF_SALT, iterations: int = KDF_ITERATIONS) -> bytes:
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=iterations,
+    )
+    return base64.urlsafe_b64encode(kdf.derive(password.encode()))
+
+
+class KdfParams(NamedTuple):
+    algorithm: str = "pbkdf2-sha256"
+    cost: int = KDF_ITERATIONS  # PBKDF2 iterations or scrypt N
+    r: int = 8
+    p: int = 1
+
+    def encode(self) -> str:
+        if self.algorithm == "scrypt":
+            return f"scrypt:{self.cost}:{self.r}:{self.p}"
+        return f"{self.algorithm}:{self.cost}"
+
+    @classmethod
+    def decode(cls, value: str) -> "KdfParams":
+        algorithm, *numbers = value.split(":")
+        return cls(algorithm, *map(int, numbers))
+
+    def _kdf(self, salt: bytes):
+        if self.algorithm == "pbkdf2-sha256":
+            return PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=self.cost)
+        if self.algorithm == "scrypt":
+            return Scrypt(salt=salt, length=32, n=self.cost, r=self.r, p=self.p)
+        raise ValueError(f"Unknown KDF algorithm: {self.algorithm}")
+
+    def validate(self) -> "KdfParams":
+        # Raises ValueError for an unknown algorithm or invalid costs without
+        # running the (slow) derivation.
+        if self.cost < 1:
+            raise ValueError(f"Invalid KDF cost: {self.cost}")
+        self._kdf(bytes(SALT_SIZE))
+        return self
+
+    def derive(self, password: str, salt: bytes) -> bytes:
+        return base64.urlsafe_b64encode(self._kdf(salt).derive(password.encode()))
+
+
+# Users without a row in the users table still use the original scheme.
+LEGACY_KDF = KdfParams("pbkdf2-sha256", KDF_ITERATIONS)
+DEFAULT_KDF = KdfParams("pbkdf2-sha256", KDF_ITERATIONS)
+
+
+def derive_user_key(user_id: int, salt: bytes, params: KdfParams) -> bytes:
+    return params.derive(str(user_id), salt)
+
+
+def calibrate_kdf(target_seconds: float, algorithm: str = "pbkdf2-sha256",
+                  max_scrypt_n: int = 2 ** 17) -> Tuple[KdfParams, float]:
+    # Picks the largest cost whose derivation on this host stays within
+    # target_seconds; returns the parameters and their measured time.
+    salt = os.urandom(SALT_SIZE)
+
+    def measure(params):
+        start = time.perf_counter()
+        params.derive("calibration", salt)
+        return time.perf_counter() - start
+
+    if algorithm == "pbkdf2-sha256":
+        probe = KdfParams(algorithm, 50000)
+        elapsed = min(measure(probe) for _ in range(3))
+        iterations = max(1000, int(probe.cost * target_seconds / elapsed) // 1000 * 1000)
+        params = KdfParams(algorithm, iterations)
+        return params, min(measure(params) for _ in range(3))
+    if algorithm == "scrypt":
+        # N must be a power of two and memory grows with it, so step up
+        # until the next doubling would exceed the target.
+        params = KdfParams(algorithm, 2 ** 10)
+        elapsed = measure(params)
+        while params.cost < max_scrypt_n:
+            candidate = params._replace(cost=params.cost * 2)
+            candidate_elapsed = measure(candidate)
+            if candidate_elapsed > target_seconds:
+                break
+            params, elapsed = candidate, candidate_elapsed
+        return params, elapsed
+    raise ValueError(f"Unknown KDF algorithm: {algorithm}")
+
+
+def normalize_account(account: str) -> str:
+    return account.strip().casefold()
+
+
+def _rename_duplicate_accounts(conn: sqlite3.Connection):
+    # Keep the oldest row under its name; later duplicates get a "#<id>"
+    # suffix so no stored password is lost when the unique index appears.
+    # The suffixed name may itself be taken already ("gmail #2" saved by
+    # hand), so it is checked and extended until it is free.
+    duplicates = conn.execute('''
+        SELECT id, user_id, account FROM passwords
+        WHERE id NOT IN (SELECT MIN(id) FROM passwords GROUP BY user_id, account)
+        ORDER BY id
+    ''').fetchall()
+    for row_id, user_id, account in duplicates:
+        name = f"{account} #{row_id}"
+        attempt = 1
+        while conn.execute(
+            "SELECT 1 FROM passwords WHERE user_id = ? AND account = ?", (user_id, name)
+        ).fetchone():
+            attempt += 1
+            name = f"{account} #{row_id}-{attempt}"
+        conn.execute("UPDATE passwords SET account = ? WHERE id = ?", (name, row_id))
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_passwords_user_account ON passwords (user_id, account)"
+    )
+
+
+def _index_user_rows(conn: sqlite3.Connection):
+    # Entries of an index on user_id are (user_id, rowid), so this also
+    # serves keyset pagination ordered by id within one user.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_passwords_user ON passwords (user_id)")
+
+
+def _binary_ciphertext_column(conn: sqlite3.Connection):
+    # encrypted_password becomes a BLOB "ciphertext" column. Legacy values are
+    # copied unchanged and stay TEXT, which is how readers tell the formats
+    # apart until SecureStorage.migrate_legacy_rows() has rewritten them.
+    conn.execute('''
+        CREATE TABLE passwords_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            account TEXT NOT NULL,
+            ciphertext BLOB NOT NULL,
+            date_added TEXT NOT NULL
+        )
+    ''')
+    conn.execute(
+        "INSERT INTO passwords_new (id, user_id, account, ciphertext, date_added) "
+        "SELECT id, user_id, account, encrypted_password, date_added FROM passwords"
+    )
+    conn.execute("DROP TABLE passwords")
+    conn.execute("ALTER TABLE passwords_new RENAME TO passwords")
+    conn.execute("CREATE UNIQUE INDEX idx_passwords_user_account ON passwords (user_id, account)")
+    conn.execute("CREATE INDEX idx_passwords_user ON passwords (user_id)")
+
+
+def _users_table(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            salt BLOB NOT NULL,
+            kdf TEXT NOT NULL,
+            updated TEXT NOT NULL
+        )
+    ''')
+
+
+def _account_norm_column(conn: sqlite3.Connection):
+    # SQLite's lower() folds ASCII only, so the normalised name used for
+    # case-insensitive lookups and prefix search is computed in Python.
+    conn.execute("ALTER TABLE passwords ADD COLUMN account_norm TEXT NOT NULL DEFAULT ''")
+    rows = conn.execute("SELECT id, account FROM passwords").fetchall()
+    conn.executemany(
+        "UPDATE passwords SET account_norm = ? WHERE id = ?",
+        [(normalize_account(account), row_id) for row_id, account in rows]
+    )
+    conn.execute("CREATE INDEX idx_passwords_user_norm ON passwords (user_id, account_norm)")
+
+
+# Applied in order; the position in the list (1-based) is the schema version
+# stored in PRAGMA user_version. Never reorder or edit released migrations.
+MIGRATIONS = [
+    _rename_duplicate_accounts,
+    _index_user_rows,
+    _binary_ciphertext_column,
+    _users_table,
+    _account_norm_column,
+]
+
+
+class PasswordPage(NamedTuple):
+    entries: List[dict]
+    prev_cursor: Optional[int]
+    next_cursor: Optional[int]
+
+
+# Cipher objects for one user, built once per cached key.
+# v1 (legacy): TEXT holding urlsafe_b64encode(Fernet token).
+# v2: BLOB b"\x02" + 12-byte nonce + AES-256-GCM ciphertext and tag, with the
+#     user id as associated data so rows cannot be moved between users.
+#
+# The key lives inside the Fernet and AESGCM objects as immutable bytes, so
+# it cannot be zeroed from Python: evicting a cipher only drops the last
+# reference, and the memory is freed (not wiped) by the garbage collector.
+class UserCipher:
+    __slots__ = ("fernet", "aead")
+
+    def __init__(self, key: bytes):
+        self.fernet = Fernet(key)
+        self.aead = AESGCM(HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b"crypto_bot ciphertext v2",
+        ).derive(base64.urlsafe_b64decode(key)))
+
+    def encrypt(self, data: str, user_id: int) -> bytes:
+        nonce = os.urandom(NONCE_SIZE)
+        return bytes([CIPHERTEXT_V2]) + nonce + self.aead.encrypt(nonce, data.encode(), str(user_id).encode())
+
+    def decrypt(self, ciphertext, user_id: int) -> str:
+        if isinstance(ciphertext, str):
+            return self.fernet.decrypt(base64.urlsafe_b64decode(ciphertext.encode())).decode()
+        if ciphertext[0] != CIPHERTEXT_V2:
+            raise ValueError(f"Unknown ciphertext version: {ciphertext[0]}")
+        nonce = ciphertext[1:1 + NONCE_SIZE]
+        return self.aead.decrypt(nonce, ciphertext[1 + NONCE_SIZE:], str(user_id).encode()).decode()
+
+
+class KeyCache:
+    def __init__(self, max_size: int = KEY_CACHE_SIZE, ttl: float = KEY_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[UserCipher]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, cipher = entry
+            if expires_at <= now:
+                self._evict(user_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return cipher
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.peek(user_id) is not None
+
+    def peek(self, user_id: int) -> Optional[UserCipher]:
+        # Like get(), but leaves the LRU order and the hit/miss stats alone.
+        with self._lock:
+            entry = self._entries.get(user_id)
+            return entry[1] if entry is not None and entry[0] > time.monotonic() else None
+
+    def put(self, user_id: int, key: bytes) -> UserCipher:
+        return self.put_cipher(user_id, UserCipher(key))
+
+    def put_cipher(self, user_id: int, cipher: UserCipher) -> UserCipher:
+        if self.max_size <= 0:
+            return cipher
+        with self._lock:
+            if user_id in self._entries:
+                self._evict(user_id)
+            self._entries[user_id] = (time.monotonic() + self.ttl, cipher)
+            while len(self._entries) > self.max_size:
+                self._evict(next(iter(self._entries)))
+        return cipher
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            if user_id in self._entries:
+                self._evict(user_id)
+
+    def clear(self):
+        with self._lock:
+            for user_id in list(self._entries):
+                self._evict(user_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def _evict(self, user_id: int):
+        del self._entries[user_id]
+        self.evictions += 1
+
+
+# Decrypted vault listings and pages, per user, for a short TTL. Any write to
+# a user's vault drops all of that user's entries once it is committed.
+#
+# A read that started before a write may finish after the invalidation; to
+# keep it from caching what it read, loads take a token() first and store()
+# is ignored if that user was invalidated since. Writes to other users do
+# not affect it. Only the last max_users invalidations are remembered; a
+# token older than a forgotten one is refused for every user.
+#
+# With encrypt=True entries are kept as AES-GCM ciphertext under a random
+# key that exists only in this process, so plaintext passwords do not sit in
+# memory between requests; a hit then costs one small decryption.
+class ListingCache:
+    def __init__(self, max_users: int = LISTING_CACHE_SIZE, ttl: float = LISTING_CACHE_TTL,
+                 encrypt: bool = False, per_user: int = LISTING_CACHE_PER_USER):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.per_user = per_user
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._aead = AESGCM(AESGCM.generate_key(bit_length=256)) if encrypt else None
+        self._users = OrderedDict()
+        # user_id -> value of _generation at the user's last invalidation.
+        self._invalidated = OrderedDict()
+        self._generation = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def token(self) -> int:
+        return self._generation
+
+    def lookup(self, user_id: int, key: tuple):
+        now = time.monotonic()
+        with self._lock:
+            entries = self._users.get(user_id)
+            entry = entries.get(key) if entries else None
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del entries[key]
+                self.misses += 1
+                return None
+            self._users.move_to_end(user_id)
+            entries.move_to_end(key)
+            self.hits += 1
+            value = entry[1]
+        if self._aead is not None:
+            nonce, data = value
+            value = json.loads(self._aead.decrypt(nonce, data, repr((user_id, key)).encode()))
+        return value
+
+    def store(self, user_id: int, key: tuple, value, token: int):
+        if self.max_users <= 0:
+            return
+        if self._aead is not None:
+            nonce = os.urandom(NONCE_SIZE)
+            value = (nonce, self._aead.encrypt(nonce, json.dumps(value).encode(), repr((user_id, key)).encode()))
+        with self._lock:
+            if token < self._floor or token < self._invalidated.get(user_id, 0):
+                return
+            entries = self._users.get(user_id)
+            if entries is None:
+                entries = self._users[user_id] = OrderedDict()
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(user_id)
+            entries[key] = (time.monotonic() + self.ttl, value)
+            entries.move_to_end(key)
+            while len(entries) > self.per_user:
+                entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._generation += 1
+            self._invalidated[user_id] = self._generation
+            self._invalidated.move_to_end(user_id)
+            while len(self._invalidated) > max(self.max_users, 1):
+                _, generation = self._invalidated.popitem(last=False)
+                self._floor = max(self._floor, generation)
+            if self._users.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._floor = self._generation
+            self._invalidated.clear()
+            self._users.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "users": len(self._users),
+                "entries": sum(len(entries) for entries in self._users.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+class ConnectionPool:
+    def __init__(self, db_path: str, size: int = POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Writes are acknowledged only after an fsync'ed commit; WriteBatcher
+        # amortises that fsync over many writes.
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT * 1000)}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+class LockStripes:
+    def __init__(self, stripes: int = LOCK_STRIPES):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def __call__(self, user_id: int) -> threading.Lock:
+        return self._locks[hash(user_id) % len(self._locks)]
+
+
+# Write-behind queue with group commit: a single writer thread collects
+# pending writes from all users until it has max_batch of them or max_delay
+# has passed since the first one, then applies them in one transaction (one
+# fsync). Each write runs inside its own savepoint, so a failing write only
+# fails its own future. Futures are resolved after COMMIT returns.
+class WriteBatcher:
+    def __init__(self, storage: "SecureStorage", max_batch: int = WRITE_BATCH_SIZE,
+                 max_delay: float = WRITE_BATCH_DELAY):
+        self.storage = storage
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="storage-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, op: Callable, *args) -> Future:
+        future = Future()
+        self._queue.put((future, op, args))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+    def _flush(self, batch):
+        results = []
+        try:
+            with metrics.timer("storage_seconds", method="write_batch"), \
+                    self.storage.write_transaction() as conn:
+                for future, op, args in batch:
+                    conn.execute("SAVEPOINT write")
+                    try:
+                        results.append((future, op(conn, *args), None))
+                        conn.execute("RELEASE write")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO write")
+                        conn.execute("RELEASE write")
+                        results.append((future, None, e))
+        except Exception as e:
+            self._invalidate(batch)
+            for future, _, _ in batch:
+                future.set_exception(e)
+            return
+        self._invalidate(batch)
+        metrics.inc("storage_write_batches_total")
+        metrics.inc("storage_batched_writes_total", len(batch))
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def _invalidate(self, batch):
+        # Before any future is resolved: .result() returns as soon as the
+        # result is set, so a reader woken by it must not find stale listings.
+        # args[0] of every op is the user id.
+        for user_id in dict.fromkeys(args[0] for _, _, args in batch):
+            self.storage.listing_cache.invalidate(user_id)
+
+
+def _insert_password(conn: sqlite3.Connection, user_id: int, account: str, ciphertext: bytes) -> bool:
+    cursor = conn.execute(
+        "INSERT INTO passwords (user_id, account, account_norm, ciphertext, date_added) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (user_id, account) DO NOTHING",
+        (user_id, account, normalize_account(account), ciphertext, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    )
+    return cursor.rowcount == 1
+
+
+def _find_account(conn: sqlite3.Connection, user_id: int, account: str, columns: str = "id"):
+    # Exact name first (unique index); otherwise a case-insensitive match,
+    # but only if it is unambiguous.
+    row = conn.execute(
+        f"SELECT {columns} FROM passwords WHERE user_id = ? AND account = ?", (user_id, account)
+    ).fetchone()
+    if row is not None:
+        return row
+    rows = conn.execute(
+        f"SELECT {columns} FROM passwords WHERE user_id = ? AND account_norm = ? LIMIT 2",
+        (user_id, normalize_account(account))
+    ).fetchall()
+    return rows[0] if len(rows) == 1 else None
+
+
+def _update_password(conn: sqlite3.Connection, user_id: int, account: str, ciphertext: bytes) -> bool:
+    row = _find_account(conn, user_id, account)
+    if row is None:
+        return False
+    conn.execute("UPDATE passwords SET ciphertext = ? WHERE id = ?", (ciphertext, row[0]))
+    return True
+
+
+def _delete_password(conn: sqlite3.Connection, user_id: int, account: str) -> bool:
+    row = _find_account(conn, user_id, account)
+    if row is None:
+        return False
+    conn.execute("DELETE FROM passwords WHERE id = ?", (row[0],))
+    return True
+
+
+class StaleKdfParams(Exception):
+    pass
+
+
+def _rewrap_user(conn: sqlite3.Connection, user_id: int, expected: Optional[tuple],
+                 old_cipher: Optional[UserCipher], new_cipher: UserCipher,
+                 salt: bytes, params: KdfParams) -> int:
+    # expected is the (salt, kdf) users row the old key was derived from, None
+    # for a legacy user. Another process sharing the database may have
+    # re-wrapped the user since; re-encrypting with a stale key would then
+    # destroy the rows, so the write is refused instead.
+    row = conn.execute("SELECT salt, kdf FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    if (tuple(row) if row is not None else None) != expected:
+        raise StaleKdfParams(f"KDF parameters of user {user_id} changed meanwhile")
+    if old_cipher is None and conn.execute(
+        "SELECT 1 FROM passwords WHERE user_id = ? LIMIT 1", (user_id,)
+    ).fetchone() is not None:
+        raise StaleKdfParams(f"User {user_id} has rows now")
+    updates = []
+    if old_cipher is not None:
+        for row_id, ciphertext in conn.execute(
+            "SELECT id, ciphertext FROM passwords WHERE user_id = ?", (user_id,)
+        ).fetchall():
+            try:
+                password = old_cipher.decrypt(ciphertext, user_id)
+            except Exception as e:
+                # Unreadable with the only key it could have been written
+                # with; it stays as it is instead of blocking the re-wrap.
+                print(f"Error decrypting password {row_id} of user {user_id} while re-wrapping: {e}")
+                continue
+            updates.append((new_cipher.encrypt(password, user_id), row_id))
+        conn.executemany("UPDATE passwords SET ciphertext = ? WHERE id = ?", updates)
+    conn.execute(
+        "INSERT OR REPLACE INTO users (user_id, salt, kdf, updated) VALUES (?, ?, ?, ?)",
+        (user_id, salt, params.encode(), datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    )
+    return len(updates)
+
+
+def _delete_user_passwords(conn: sqlite3.Connection, user_id: int) -> int:
+    return conn.execute("DELETE FROM passwords WHERE user_id = ?", (user_id,)).rowcount
 
 
 class SecureStorage:
-    def __init__(self, db_path: str = "passwords.db"):
+    def __init__(self, db_path: str = "passwords.db",
+                 key_cache_size: int = KEY_CACHE_SIZE, key_cache_ttl: float = KEY_CACHE_TTL,
+                 pool_size: int = POOL_SIZE, lock_stripes: int = LOCK_STRIPES,
+                 batch_writes: bool = False, batch_size: int = WRITE_BATCH_SIZE,
+                 batch_delay: float = WRITE_BATCH_DELAY, kdf_policy: KdfParams = DEFAULT_KDF,
+                 listing_cache_size: int = LISTING_CACHE_SIZE, listing_cache_ttl: float = LISTING_CACHE_TTL,
+                 listing_cache_encrypt: bool = False):
         self.db_path = db_path
-        self.lock = threading.Lock()
+        self.pool = ConnectionPool(db_path, pool_size)
+        self.user_lock = LockStripes(lock_stripes)
+        # SQLite allows a single writer; serialising writers here avoids
+        # busy-waiting inside the database while readers proceed in parallel.
+        self.write_lock = threading.Lock()
+        self.key_cache = KeyCache(key_cache_size, key_cache_ttl)
+        self.kdf_policy = kdf_policy
+        self.listing_cache = ListingCache(listing_cache_size, listing_cache_ttl, listing_cache_encrypt)
         self.init_db()
-    
+        self.batcher = WriteBatcher(self, batch_size, batch_delay) if batch_writes else None
+
+    @contextmanager
+    def write_transaction(self):
+        with self.pool.connection() as conn, self.write_lock:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                yield conn
+
     def init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
+        with self.write_transaction() as conn:
+            conn.execute('''
                 CREATE TABLE IF NOT EXISTS passwords (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER NOT NULL,
@@ -25,87 +702,441 @@ class SecureStorage:
                     date_added TEXT NOT NULL
                 )
             ''')
-            conn.commit()
-    
-    def generate_key_from_password(self, password: str) -> bytes:
-        password_bytes = password.encode()
-        salt = b'salt_12345678'
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(password_bytes))
-        return key
-    
-    def encrypt_data(self, data: str, key: bytes) -> str:
-        f = Fernet(key)
-        encrypted_bytes = f.encrypt(data.encode())
-        return base64.urlsafe_b64encode(encrypted_bytes).decode()
-
-    def decrypt_data(self, encrypted_data: str, key: bytes) -> str:
-        f = Fernet(key)
-        encrypted_bytes = base64.urlsafe_b64decode(encrypted_data.encode())
-        decrypted_bytes = f.decrypt(encrypted_bytes)
-        return decrypted_bytes.decode()
+        self.migrate()
+
+    def migrate(self) -> int:
+        with self.write_transaction() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for number in range(version + 1, len(MIGRATIONS) + 1):
+                MIGRATIONS[number - 1](conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+            return max(version, len(MIGRATIONS))
+
+    def close(self):
+        if self.batcher is not None:
+            self.batcher.close()
+        self.pool.close()
+        self.key_cache.clear()
+        self.listing_cache.clear()
     
-    def save_password(self, user_id: int, account: str, password: str):
-        with self.lock:
-            key = self.generate_key_from_password(str(user_id))
-            encrypted_password = self.encrypt_data(password, key)
-            
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT INTO passwords (user_id, account, encrypted_password, date_added) VALUES (?, ?, ?, ?)",
-                    (user_id, account, encrypted_password, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-                )
-                conn.commit()
+    def user_kdf(self, user_id: int) -> Tuple[bytes, KdfParams, bool]:
+        # Returns (salt, params, is_legacy) stored for the user.
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT salt, kdf FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return KDF_SALT, LEGACY_KDF, True
+        return bytes(row[0]), KdfParams.decode(row[1]), False
+
+    def get_user_cipher(self, user_id: int) -> UserCipher:
+        cipher = self.key_cache.get(user_id)
+        if cipher is None:
+            cipher, _ = self._load_user_cipher(user_id)
+        return cipher
+
+    def _load_user_cipher(self, user_id: int, cache: bool = True) -> Tuple[UserCipher, int]:
+        # Cache miss: derive the key from the stored salt and parameters. If
+        # they differ from the current policy (or the user predates per-user
+        # salts), derive a new key under the policy and re-encrypt all the
+        # user's rows with it in one write. Returns the cipher and the number
+        # of re-encrypted rows. With cache=False (background migration) the
+        # cipher is not put into the key cache.
+        with self.user_lock(user_id):
+            cipher = self.key_cache.peek(user_id)
+            if cipher is not None:
+                return cipher, 0
+            for _ in range(REWRAP_ATTEMPTS):
+                salt, params, legacy = self.user_kdf(user_id)
+                if not legacy and params == self.kdf_policy:
+                    with metrics.phase("storage_phase_seconds", "kdf"):
+                        cipher = UserCipher(derive_user_key(user_id, salt, params))
+                    return self._cache_cipher(user_id, cipher, cache), 0
+
+                new_salt = os.urandom(SALT_SIZE)
+                with metrics.phase("storage_phase_seconds", "kdf"):
+                    new_cipher = UserCipher(derive_user_key(user_id, new_salt, self.kdf_policy))
+                with self.pool.connection() as conn:
+                    has_rows = conn.execute(
+                        "SELECT 1 FROM passwords WHERE user_id = ? LIMIT 1", (user_id,)
+                    ).fetchone() is not None
+                old_cipher = None
+                if has_rows:
+                    with metrics.phase("storage_phase_seconds", "kdf"):
+                        old_cipher = UserCipher(derive_user_key(user_id, salt, params))
+                expected = None if legacy else (salt, params.encode())
+                try:
+                    rewrapped = self._write_locked(
+                        _rewrap_user, user_id, expected, old_cipher, new_cipher, new_salt, self.kdf_policy
+                    )
+                except StaleKdfParams:
+                    # Re-wrapped by another process: start over from what is stored now.
+                    continue
+                except Exception as e:
+                    # Nothing was written, so the old key still matches the
+                    # rows; use it for this call only and retry next time.
+                    print(f"Error re-wrapping keys for user {user_id}: {e}")
+                    if old_cipher is None:
+                        raise
+                    return old_cipher, 0
+                if rewrapped:
+                    metrics.inc("storage_rewrapped_rows_total", rewrapped)
+                return self._cache_cipher(user_id, new_cipher, cache), rewrapped
+            raise RuntimeError(f"KDF parameters of user {user_id} keep changing")
+
+    def _cache_cipher(self, user_id: int, cipher: UserCipher, cache: bool) -> UserCipher:
+        return self.key_cache.put_cipher(user_id, cipher) if cache else cipher
+
+    def write(self, user_id: int, op: Callable, *args) -> Future:
+        # Returns a future resolved once the write is committed: queued to the
+        # batcher when group commit is enabled, otherwise run right away.
+        # Either way the user's cached listings are dropped before the future
+        # is resolved.
+        if self.batcher is not None:
+            return self.batcher.submit(op, user_id, *args)
+        future = Future()
+        try:
+            with self.user_lock(user_id), self._invalidating(user_id):
+                result = self._write_locked(op, user_id, *args)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        return future
+
+    def _write_locked(self, op: Callable, user_id: int, *args):
+        # Caller holds the user's lock. Going through the batcher keeps the
+        # write ordered after any writes of this user already queued.
+        if self.batcher is not None:
+            return self.batcher.submit(op, user_id, *args).result()
+        with metrics.phase("storage_phase_seconds", "db"), self.write_transaction() as conn:
+            return op(conn, user_id, *args)
+
+    @contextmanager
+    def _invalidating(self, user_id: int):
+        # For writes that bypass write(): drops cached listings after commit.
+        try:
+            yield
+        finally:
+            self.listing_cache.invalidate(user_id)
+
+    @metrics.timed("storage_seconds", "method", "save_password")
+    def submit_save_password(self, user_id: int, account: str, password: str) -> Future:
+        cipher = self.get_user_cipher(user_id)
+        with metrics.phase("storage_phase_seconds", "crypto"):
+            ciphertext = cipher.encrypt(password, user_id)
+        return self.write(user_id, _insert_password, account, ciphertext)
+
+    def save_password(self, user_id: int, account: str, password: str) -> bool:
+        return self.submit_save_password(user_id, account, password).result()
     
-    def get_passwords(self, user_id: int):
-        with self.lock:
-            key = self.generate_key_from_password(str(user_id))
-            
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT account, encrypted_password, date_added FROM passwords WHERE user_id = ?",
-                    (user_id,)
-                )
-                rows = cursor.fetchall()
-                
-                result = []
-                for row in rows:
-                    try:
-                        decrypted_password = self.decrypt_data(row[1], key)
-                        result.append({
-                            "account": row[0],
-                            "password": decrypted_password,
-                            "date_added": row[2]
-                        })
-                    except Exception as e:
-                        print(f"Error decrypting password for user {user_id}: {e}")
-                        result.append({
-                            "account": row[0],
-                            "password": "[Ошибка при расшифровке]",
-                            "date_added": row[2]
-                        })
-                return result
+    def _decrypt_rows(self, user_id: int, cipher: UserCipher, rows) -> List[dict]:
+        result = []
+        with metrics.phase("storage_phase_seconds", "crypto"):
+            for row in rows:
+                try:
+                    decrypted_password = cipher.decrypt(row[1], user_id)
+                    result.append({
+                        "account": row[0],
+                        "password": decrypted_password,
+                        "date_added": row[2]
+                    })
+                except Exception as e:
+                    print(f"Error decrypting password for user {user_id}: {e}")
+                    result.append({
+                        "account": row[0],
+                        "password": "[Ошибка при расшифровке]",
+                        "date_added": row[2]
+                    })
+        return result
+
+    def cached_passwords(self, user_id: int) -> Optional[List[dict]]:
+        return self.listing_cache.lookup(user_id, ("all",))
+
+    def get_passwords(self, user_id: int) -> List[dict]:
+        entries = self.cached_passwords(user_id)
+        if entries is None:
+            entries = self.load_passwords(user_id)
+        return entries
+
+    @metrics.timed("storage_seconds", "method")
+    def load_passwords(self, user_id: int) -> List[dict]:
+        token = self.listing_cache.token()
+        # The key is loaded before reading: loading may re-encrypt the rows.
+        cipher = self.get_user_cipher(user_id)
+        with metrics.phase("storage_phase_seconds", "db"), self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT account, ciphertext, date_added FROM passwords WHERE user_id = ?",
+                (user_id,)
+            ).fetchall()
+        entries = self._decrypt_rows(user_id, cipher, rows)
+        self.listing_cache.store(user_id, ("all",), entries, token)
+        return entries
+
+    def cached_passwords_page(self, user_id: int, cursor: int = 0, limit: int = PAGE_SIZE,
+                              backward: bool = False) -> Optional[PasswordPage]:
+        page = self.listing_cache.lookup(user_id, ("page", cursor, limit, backward))
+        return PasswordPage(*page) if page is not None else None
+
+    def get_passwords_page(self, user_id: int, cursor: int = 0, limit: int = PAGE_SIZE,
+                           backward: bool = False) -> PasswordPage:
+        page = self.cached_passwords_page(user_id, cursor, limit, backward)
+        if page is None:
+            page = self.load_passwords_page(user_id, cursor, limit, backward)
+        return page
+
+    @metrics.timed("storage_seconds", "method")
+    def load_passwords_page(self, user_id: int, cursor: int = 0, limit: int = PAGE_SIZE,
+                            backward: bool = False) -> PasswordPage:
+        # Keyset pagination over row ids: a forward page holds rows with
+        # id > cursor, a backward page rows with id < cursor. Only the rows
+        # of the requested page are decrypted.
+        token = self.listing_cache.token()
+        cipher = self.get_user_cipher(user_id)
+        with metrics.phase("storage_phase_seconds", "db"), self.pool.connection() as conn:
+            if backward:
+                rows = conn.execute(
+                    "SELECT id, account, ciphertext, date_added FROM passwords "
+                    "WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                    (user_id, cursor, limit)
+                ).fetchall()
+                rows.reverse()
+            else:
+                rows = conn.execute(
+                    "SELECT id, account, ciphertext, date_added FROM passwords "
+                    "WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+                    (user_id, cursor, limit)
+                ).fetchall()
+            if not rows:
+                return PasswordPage([], None, None)
+            first_id, last_id = rows[0][0], rows[-1][0]
+            has_prev = conn.execute(
+                "SELECT 1 FROM passwords WHERE user_id = ? AND id < ? LIMIT 1", (user_id, first_id)
+            ).fetchone() is not None
+            has_next = conn.execute(
+                "SELECT 1 FROM passwords WHERE user_id = ? AND id > ? LIMIT 1", (user_id, last_id)
+            ).fetchone() is not None
+
+        entries = self._decrypt_rows(user_id, cipher, [row[1:] for row in rows])
+        page = PasswordPage(
+            entries,
+            first_id if has_prev else None,
+            last_id if has_next else None,
+        )
+        self.listing_cache.store(user_id, ("page", cursor, limit, backward), page, token)
+        return page
     
-    def delete_all_passwords(self, user_id: int):
-        with self.lock:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM passwords WHERE user_id = ?", (user_id,))
-                conn.commit()
+    @metrics.timed("storage_seconds", "method")
+    def import_passwords(self, user_id: int, rows: Iterable[Tuple[str, str]],
+                         batch_size: int = IMPORT_BATCH) -> Tuple[int, int]:
+        # Consumes rows lazily: the key is looked up once, every batch is
+        # encrypted and inserted with executemany, and the whole import is a
+        # single transaction. Existing accounts are left untouched.
+        cipher = self.get_user_cipher(user_id)
+        date_added = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        inserted = total = 0
+        rows = iter(rows)
+        with self.user_lock(user_id), self._invalidating(user_id), self.write_transaction() as conn:
+            while True:
+                batch = [
+                    (user_id, account, normalize_account(account), cipher.encrypt(password, user_id), date_added)
+                    for account, password in itertools.islice(rows, batch_size)
+                ]
+                if not batch:
+                    break
+                total += len(batch)
+                inserted += conn.executemany(
+                    "INSERT INTO passwords (user_id, account, account_norm, ciphertext, date_added) "
+                    "VALUES (?, ?, ?, ?, ?) ON CONFLICT (user_id, account) DO NOTHING",
+                    batch
+                ).rowcount
+        return inserted, total - inserted
+
+    def iter_passwords(self, user_id: int, batch_size: int = EXPORT_BATCH) -> Iterator[dict]:
+        # Walks the vault in id order one batch at a time; no connection is
+        # held between batches and at most batch_size rows are in memory.
+        cipher = self.get_user_cipher(user_id)
+        after_id = 0
+        while True:
+            with self.pool.connection() as conn:
+                rows = conn.execute(
+                    "SELECT id, account, ciphertext, date_added FROM passwords "
+                    "WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+                    (user_id, after_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            after_id = rows[-1][0]
+            yield from self._decrypt_rows(user_id, cipher, [row[1:] for row in rows])
+
+    @metrics.timed("storage_seconds", "method")
+    def migrate_legacy_rows(self, after_id: int = 0, limit: int = MIGRATION_BATCH):
+        # Finds users that still have v1 rows and loads their keys, which
+        # re-encrypts all their rows under the current KDF policy. Returns
+        # (converted rows, next after_id); next after_id is None at the end.
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT id, user_id FROM passwords "
+                "WHERE id > ? AND typeof(ciphertext) = 'text' ORDER BY id LIMIT ?",
+                (after_id, limit)
+            ).fetchall()
+        if not rows:
+            return 0, None
+
+        # Keys are derived only for the re-wrap and then dropped, so the
+        # migration does not push active users out of the key cache.
+        converted = 0
+        for user_id in dict.fromkeys(user_id for _, user_id in rows):
+            if user_id in self.key_cache:
+                continue
+            try:
+                # v1 rows left behind for a user already on the current
+                # policy are the ones a re-wrap could not decrypt.
+                _, params, legacy = self.user_kdf(user_id)
+                if not legacy and params == self.kdf_policy:
+                    continue
+                converted += self._load_user_cipher(user_id, cache=False)[1]
+            except Exception as e:
+                print(f"Error migrating passwords for user {user_id}: {e}")
+        return converted, rows[-1][0]
+
+    @metrics.timed("storage_seconds", "method")
+    def delete_all_passwords(self, user_id: int) -> int:
+        return self.write(user_id, _delete_user_passwords).result()
+
+    @metrics.timed("storage_seconds", "method")
+    def get_password(self, user_id: int, account: str) -> Optional[dict]:
+        # One index lookup and a single decryption.
+        cipher = self.get_user_cipher(user_id)
+        with metrics.phase("storage_phase_seconds", "db"), self.pool.connection() as conn:
+            row = _find_account(conn, user_id, account, "account, ciphertext, date_added")
+        if row is None:
+            return None
+        return self._decrypt_rows(user_id, cipher, [row])[0]
+
+    @metrics.timed("storage_seconds", "method")
+    def find_accounts(self, user_id: int, prefix: str, limit: int = FIND_LIMIT) -> Tuple[List[dict], bool]:
+        # Case-insensitive prefix search as a range scan over
+        # (user_id, account_norm); nothing is decrypted. Returns up to limit
+        # entries (account, date_added) and whether there are more.
+        prefix = normalize_account(prefix)
+        with metrics.phase("storage_phase_seconds", "db"), self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT account, date_added FROM passwords "
+                "WHERE user_id = ? AND account_norm >= ? AND account_norm < ? "
+                "ORDER BY account_norm LIMIT ?",
+                (user_id, prefix, prefix + "\U0010ffff", limit + 1)
+            ).fetchall()
+        entries = [{"account": account, "date_added": date_added} for account, date_added in rows[:limit]]
+        return entries, len(rows) > limit
+
+    @metrics.timed("storage_seconds", "method", "update_password")
+    def submit_update_password(self, user_id: int, account: str, password: str) -> Future:
+        cipher = self.get_user_cipher(user_id)
+        with metrics.phase("storage_phase_seconds", "crypto"):
+            ciphertext = cipher.encrypt(password, user_id)
+        return self.write(user_id, _update_password, account, ciphertext)
+
+    def update_password(self, user_id: int, account: str, password: str) -> bool:
+        return self.submit_update_password(user_id, account, password).result()
+
+    @metrics.timed("storage_seconds", "method")
+    def delete_password(self, user_id: int, account: str) -> bool:
+        return self.write(user_id, _delete_password, account).result()
     
+    @metrics.timed("storage_seconds", "method")
     def account_exists(self, user_id: int, account: str) -> bool:
-        with self.lock:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT 1 FROM passwords WHERE user_id = ? AND account = ?",
-                    (user_id, account)
-                )
-                return cursor.fetchone() is not None
\ No newline at end of file
+        with metrics.phase("storage_phase_seconds", "db"), self.pool.connection() as conn:
+            cursor = conn.execute(
+                "SELECT 1 FROM passwords WHERE user_id = ? AND account = ?",
+                (user_id, account)
+            )
+            return cursor.fetchone() is not None
+
+
+class AsyncSecureStorage:
+    def __init__(self, storage: SecureStorage, executor: Optional[Executor] = None,
+                 kdf_executor: Optional[Executor] = None):
+        self.storage = storage
+        self.executor = executor
+        self.kdf_executor = kdf_executor
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def _ensure_key(self, user_id: int):
+        # KDF jobs go to their own pool (possibly a process pool) so that
+        # slow derivations never starve the DB workers. Users who need their
+        # keys re-wrapped are left to the storage call itself (once per user).
+        if self.kdf_executor is None or user_id in self.storage.key_cache:
+            return
+        salt, params, legacy = await self._run(self.storage.user_kdf, user_id)
+        if legacy or params != self.storage.kdf_policy:
+            return
+        loop = asyncio.get_running_loop()
+        with metrics.timer("storage_phase_seconds", method="kdf_executor", phase="kdf"):
+            key = await loop.run_in_executor(self.kdf_executor, derive_user_key, user_id, salt, params)
+        if user_id not in self.storage.key_cache:
+            self.storage.key_cache.put(user_id, key)
+
+    async def save_password(self, user_id: int, account: str, password: str) -> bool:
+        await self._ensure_key(user_id)
+        # Only the encryption occupies an executor thread; waiting for the
+        # group commit happens on the event loop.
+        future = await self._run(self.storage.submit_save_password, user_id, account, password)
+        return await asyncio.wrap_future(future)
+
+    # Cached listings are served straight from the event loop; only misses
+    # go to the executor.
+    async def get_passwords(self, user_id: int):
+        entries = self.storage.cached_passwords(user_id)
+        if entries is not None:
+            return entries
+        await self._ensure_key(user_id)
+        return await self._run(self.storage.load_passwords, user_id)
+
+    async def get_passwords_page(self, user_id: int, cursor: int = 0, limit: int = PAGE_SIZE,
+                                 backward: bool = False) -> PasswordPage:
+        page = self.storage.cached_passwords_page(user_id, cursor, limit, backward)
+        if page is not None:
+            return page
+        await self._ensure_key(user_id)
+        return await self._run(self.storage.load_passwords_page, user_id, cursor, limit, backward)
+
+    async def import_passwords(self, user_id: int, rows: Iterable[Tuple[str, str]],
+                               batch_size: int = IMPORT_BATCH) -> Tuple[int, int]:
+        await self._ensure_key(user_id)
+        return await self._run(self.storage.import_passwords, user_id, rows, batch_size)
+
+    async def export_passwords(self, user_id: int, writer: Callable[[Iterator[dict]], object]):
+        # Runs writer(entries) in the executor so that decryption and
+        # serialisation stream row batches without touching the event loop.
+        await self._ensure_key(user_id)
+        return await self._run(lambda: writer(self.storage.iter_passwords(user_id)))
+
+    async def migrate_legacy_rows(self, after_id: int = 0, limit: int = MIGRATION_BATCH):
+        return await self._run(self.storage.migrate_legacy_rows, after_id, limit)
+
+    async def delete_all_passwords(self, user_id: int) -> int:
+        if self.storage.batcher is not None:
+            return await asyncio.wrap_future(self.storage.write(user_id, _delete_user_passwords))
+        return await self._run(self.storage.delete_all_passwords, user_id)
+
+    async def get_password(self, user_id: int, account: str) -> Optional[dict]:
+        await self._ensure_key(user_id)
+        return await self._run(self.storage.get_password, user_id, account)
+
+    async def find_accounts(self, user_id: int, prefix: str, limit: int = FIND_LIMIT) -> Tuple[List[dict], bool]:
+        return await self._run(self.storage.find_accounts, user_id, prefix, limit)
+
+    async def update_password(self, user_id: int, account: str, password: str) -> bool:
+        await self._ensure_key(user_id)
+        future = await self._run(self.storage.submit_update_password, user_id, account, password)
+        return await asyncio.wrap_future(future)
+
+    async def delete_password(self, user_id: int, account: str) -> bool:
+        if self.storage.batcher is not None:
+            return await asyncio.wrap_future(self.storage.write(user_id, _delete_password, account))
+        return await self._run(self.storage.delete_password, user_id, account)
+
+    async def account_exists(self, user_id: int, account: str) -> bool:
+        return await self._run(self.storage.account_exists, user_id, account)
\ No newline at end of file
@@ -0,0 +1,67 @@
+import asyncio
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+MAX_PENDING_UPDATES = 1024
+
+
+class _UserQueue:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+# Processes updates of different users concurrently (at most
+# max_concurrent_updates handlers running at once) while updates of the same
+# user run strictly one after another in arrival order.
+#
+# PTB's own semaphore is acquired before do_process_update, so it is sized as
+# a backlog limit (max_pending); the concurrency limit is applied only after
+# the per-user lock is taken. Otherwise a burst from one user could occupy
+# every slot while waiting on its own lock and stall everybody else.
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int, max_pending: int = MAX_PENDING_UPDATES):
+        super().__init__(max(max_pending, max_concurrent_updates))
+        self.max_running = max_concurrent_updates
+        self._running: Optional[asyncio.Semaphore] = None
+        self._queues: Dict[int, _UserQueue] = {}
+
+    @staticmethod
+    def _key(update: object) -> Optional[int]:
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: "Awaitable[Any]") -> None:
+        key = self._key(update)
+        if key is None:
+            async with self._running:
+                await coroutine
+            return
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _UserQueue()
+        queue.users += 1
+        try:
+            # asyncio.Lock wakes waiters in FIFO order, which preserves the
+            # order in which updates of this user arrived.
+            async with queue.lock, self._running:
+                await coroutine
+        finally:
+            queue.users -= 1
+            if not queue.users:
+                del self._queues[key]
+
+    async def initialize(self) -> None:
+        self._running = asyncio.Semaphore(self.max_running)
+
+    async def shutdown(self) -> None:
+        self._queues.clear()
@@ -0,0 +1,194 @@
+import base64
+import csv
+import io
+import json
+import os
+import sys
+from typing import BinaryIO, Iterable, Iterator, Tuple
+
+from cryptography.fernet import Fernet
+
+from secure_storage import derive_key
+
+IMPORT_FORMATS = ("csv", "json", "jsonl")
+READ_CHUNK = 64 * 1024
+EXPORT_MAGIC = "CRYPTO_BOT_EXPORT"
+EXPORT_VERSION = 1
+EXPORT_CHUNK_ROWS = 100
+EXPORT_KDF_ITERATIONS = 200000
+MAX_FIELD_LENGTH = 1024
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def _clean(account, password):
+    if not isinstance(account, str) or not isinstance(password, str):
+        return None
+    # Only the account name is trimmed; leading or trailing spaces can be
+    # part of a password and must survive the import byte for byte.
+    account = account.strip()
+    if not account or not password or len(account) > MAX_FIELD_LENGTH or len(password) > MAX_FIELD_LENGTH:
+        return None
+    return account, password
+
+
+def iter_csv_rows(stream: BinaryIO) -> Iterator[Tuple[str, str]]:
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    for i, row in enumerate(csv.reader(text)):
+        if len(row) < 2:
+            continue
+        if i == 0 and [c.strip().lower() for c in row[:2]] == ["account", "password"]:
+            continue
+        entry = _clean(row[0], row[1])
+        if entry:
+            yield entry
+
+
+def _entry_from_json(item):
+    if isinstance(item, dict):
+        return _clean(item.get("account"), item.get("password"))
+    if isinstance(item, list) and len(item) >= 2:
+        return _clean(item[0], item[1])
+    return None
+
+
+def _iter_json_values(stream: BinaryIO) -> Iterator:
+    # Incremental reader for a top-level JSON array: decodes one element at a
+    # time from a sliding buffer, so memory is bounded by the largest element
+    # rather than by the file size.
+    decoder = json.JSONDecoder()
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig")
+    buf = text.read(READ_CHUNK).lstrip()
+    if not buf.startswith("["):
+        raise ImportFormatError("JSON file must contain an array")
+    pos = 1
+    eof = False
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise ImportFormatError("Malformed JSON")
+            chunk = text.read(READ_CHUNK)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        # A number or literal cut at the chunk boundary decodes "successfully";
+        # make sure the value is terminated before trusting it.
+        if end == len(buf) and not eof:
+            chunk = text.read(READ_CHUNK)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        yield value
+        pos = end
+
+
+def iter_json_rows(stream: BinaryIO) -> Iterator[Tuple[str, str]]:
+    for item in _iter_json_values(stream):
+        entry = _entry_from_json(item)
+        if entry:
+            yield entry
+
+
+def iter_jsonl_rows(stream: BinaryIO) -> Iterator[Tuple[str, str]]:
+    for line in io.TextIOWrapper(stream, encoding="utf-8-sig"):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = _entry_from_json(json.loads(line))
+        except json.JSONDecodeError:
+            raise ImportFormatError("Malformed JSON line")
+        if entry:
+            yield entry
+
+
+def import_format(filename: str) -> str:
+    ext = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    if ext not in IMPORT_FORMATS:
+        raise ImportFormatError(f"Unsupported file type: {ext or filename}")
+    return ext
+
+
+def iter_import_rows(stream: BinaryIO, filename: str) -> Iterator[Tuple[str, str]]:
+    fmt = import_format(filename)
+    if fmt == "csv":
+        return iter_csv_rows(stream)
+    if fmt == "json":
+        return iter_json_rows(stream)
+    return iter_jsonl_rows(stream)
+
+
+# Export file: a text header line followed by one Fernet token per line. Each
+# token holds "<chunk number>:<1 if last else 0>\n" and up to
+# EXPORT_CHUNK_ROWS CSV rows, so the file can be written and read chunk by
+# chunk and truncated or reordered files are detected.
+def write_encrypted_export(entries: Iterable[dict], passphrase: str, out: BinaryIO,
+                           iterations: int = EXPORT_KDF_ITERATIONS) -> int:
+    salt = os.urandom(16)
+    f = Fernet(derive_key(passphrase, salt, iterations))
+    out.write(f"{EXPORT_MAGIC} {EXPORT_VERSION} {base64.b64encode(salt).decode()} {iterations}\n".encode())
+
+    def emit(index, last, rows):
+        buf = io.StringIO()
+        buf.write(f"{index}:{int(last)}\n")
+        csv.writer(buf).writerows(rows)
+        out.write(f.encrypt(buf.getvalue().encode()) + b"\n")
+
+    count, index = 0, 0
+    pending = [("account", "password", "date_added")]
+    for entry in entries:
+        pending.append((entry["account"], entry["password"], entry["date_added"]))
+        count += 1
+        if len(pending) >= EXPORT_CHUNK_ROWS:
+            emit(index, False, pending)
+            index += 1
+            pending = []
+    emit(index, True, pending)
+    return count
+
+
+def iter_encrypted_export(stream: BinaryIO, passphrase: str) -> Iterator[str]:
+    header = stream.readline().decode().split()
+    if len(header) != 4 or header[0] != EXPORT_MAGIC or header[1] != str(EXPORT_VERSION):
+        raise ImportFormatError("Not a crypto_bot export file")
+    f = Fernet(derive_key(passphrase, base64.b64decode(header[2]), int(header[3])))
+    expected = 0
+    last = False
+    for line in stream:
+        if not line.strip():
+            continue
+        if last:
+            raise ImportFormatError("Data after the final chunk")
+        chunk = f.decrypt(line.strip()).decode()
+        marker, _, body = chunk.partition("\n")
+        index, flag = marker.split(":")
+        if int(index) != expected:
+            raise ImportFormatError("Export chunks are out of order")
+        expected += 1
+        last = flag == "1"
+        yield body
+    if not last:
+        raise ImportFormatError("Export file is truncated")
+
+
+def main():
+    if len(sys.argv) != 4 or sys.argv[1] != "decrypt":
+        print("Использование: python vault_io.py decrypt <файл> <пароль>", file=sys.stderr)
+        sys.exit(2)
+    with open(sys.argv[2], "rb") as stream:
+        for body in iter_encrypted_export(stream, sys.argv[3]):
+            sys.stdout.write(body)
+
+
+if __name__ == "__main__":
+    main()